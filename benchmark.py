@@ -0,0 +1,217 @@
+#
+# Headless benchmarks for the map, game and rendering paths of nordeus.py.
+#
+# Usage: python benchmark.py [--sizes 30,100,500,1000,2000] [--out results.json]
+#                            [--baseline baseline.json] [--tolerance 0.25]
+# With --baseline the run fails (exit code 1) when any benchmark got slower than the tolerance allows.
+#
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+import pygame
+
+import nordeus
+
+DEFAULT_SIZES = [30, 100, 500, 1000, 2000]
+MIN_REGRESSION_MS = 0.05  # Differences below this are timer noise, never a regression
+SEED = 1234
+LAYER_SPRITES = 500
+
+
+#Function which will be used to time a function, returns the median and min in milliseconds
+#Big maps are slow, so the number of runs is limited by a time budget as well
+def measure(function, repeat, budget=2.0):
+    times = []
+    started = time.perf_counter()
+    while len(times) < repeat and (len(times) < 1 or time.perf_counter() - started < budget):
+        begin = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - begin) * 1000)
+    return {"median_ms": statistics.median(times), "min_ms": min(times), "runs": len(times)}
+
+
+#Function which will be used to turn the times of a batch of calls into times per call
+#The number of calls is kept, so compare can judge the noise on the time of the whole batch
+def per_call(result, calls):
+    return dict({key: value / calls if key.endswith("_ms") else value for key, value in result.items()}, calls=calls)
+
+
+def run_benchmarks(sizes, repeat):
+    app = nordeus.GameApp()
+    results = {}
+
+    # Darkening is the same work for every map size
+    results["darken_sprite"] = measure(lambda: nordeus.SpriteAtlas.darken_sprite(app.land_sprite, 0.7), repeat * 10)
+    # Ambient sprites moved, measured and drawn like the clouds of a frame
+    layer = nordeus.SpriteLayer(shadow_offset=nordeus.CLOUD_SHADOW_OFFSET)
+    rng = random.Random(SEED)
+    for index in range(LAYER_SPRITES):
+        variant = layer.variant(*app.clouds.variants[index % len(app.clouds.variants)], flip_x=index % 2 == 0)
+        layer.add(variant, rng.randrange(nordeus.WINDOW_SIZE), rng.randrange(nordeus.WINDOW_SIZE), rng.uniform(0.5, 2), rng.uniform(0, 1))
+
+    def sprite_frame():
+        layer.update()
+        layer.rects()
+        layer.render(app.screen)
+    results[f"sprite_layer[{LAYER_SPRITES}]"] = measure(sprite_frame, repeat * 10)
+    # The pause menu the game starts in
+    results["render_menu_frame"] = measure(app.render, repeat * 10)
+
+    for size in sizes:
+        print(f"Map size {size}x{size}...", file=sys.stderr)
+        results[f"gridmap_build[{size}]"] = measure(
+            lambda: nordeus.GridMap(size, 'hard', app.water_sprite, app.land_sprite, seed=SEED), repeat)
+
+        game = nordeus.Game(size, 'hard', app.water_sprite, app.land_sprite, seed=SEED)
+        results[f"find_islands[{size}]"] = measure(game.map.find_islands, repeat)
+        map_text = "\n".join(" ".join(map(str, row)) for row in game.map.heights.tolist()).encode()
+        results[f"parse_map[{size}]"] = measure(lambda: nordeus.read_matrix(map_text), repeat)
+
+        def select_target():
+            game.map._best = None  # highest_island keeps its answer, every run has to look it up again
+            game.map.highest_island()
+        results[f"target_selection[{size}]"] = measure(select_target, repeat * 10)
+
+        # Guesses on random cells, the game is reset so every call does the full lookup
+        rng = random.Random(SEED)
+        cells = [game.map.grid[rng.randrange(size)][rng.randrange(size)] for _ in range(1000)]
+
+        def guess_all():
+            for cell in cells:
+                game.attempts, game.correct_guess = 3, False
+                game.guess_island(cell)
+        guesses = measure(guess_all, repeat)
+        results[f"guess_island[{size}]"] = per_call(guesses, len(cells))
+
+        # Cell edits that flip land and water, timed per edit, the first edit also sets up the island tracking
+        edit_map = nordeus.GridMap(size, 'hard', seed=SEED)
+        edited = [(rng.randrange(size), rng.randrange(size)) for _ in range(1000)]
+        edit_map.set_height(*edited[0], 0 if edit_map.heights[edited[0]] else 1)
+
+        def edit_all():
+            for x, y in edited:
+                edit_map.set_height(x, y, 0 if edit_map.heights[x, y] else 1)
+                edit_map.highest_island()
+        edits = measure(edit_all, repeat)
+        results[f"edit_cell[{size}]"] = per_call(edits, len(edited))
+
+        def first_frame():
+            game.map.invalidate_terrain()
+            app.render()
+
+        app.game = game
+        app.pause_menu.is_paused = False
+        results[f"render_first_frame[{size}]"] = measure(first_frame, repeat)
+
+        def steady_frame():
+            app.update()
+            app.render()
+        steady_frame()
+        results[f"render_frame[{size}]"] = measure(steady_frame, repeat * 10)
+
+        # Panning across the map, new chunks come into view and old ones are evicted
+        camera = app.view.camera
+        step = [nordeus.PAN_SPEED, nordeus.PAN_SPEED]
+
+        def pan_frame():
+            if not 0 < camera.x < size * camera.cell_size - camera.width:
+                step[0] = -step[0]
+            if not 0 < camera.y < size * camera.cell_size - camera.height:
+                step[1] = -step[1]
+            camera.pan(*step)
+            app.update()
+            app.render()
+        results[f"render_pan_frame[{size}]"] = measure(pan_frame, repeat * 10)
+
+        # Hovering on and off the biggest island with the camera on it, its overlay is built again every time
+        biggest = game.map.island(int(game.map.island_sizes[1:game.map.island_count + 1].argmax()) + 1)
+        bounds = biggest.bounds()
+        camera.x, camera.y = bounds.left * camera.cell_size, bounds.top * camera.cell_size
+        camera.clamp()
+        hovered = [biggest, None]
+
+        def hover_frame():
+            app.update()
+            game.hover_island = hovered[0]
+            hovered.reverse()
+            app.view.overlays.clear()
+            app.render()
+        results[f"render_hover_frame[{size}]"] = measure(hover_frame, repeat * 10)
+        app.game = None
+
+    return results
+
+
+#Function which will be used to compare a run with a baseline run, returns the names of the regressed benchmarks
+def compare(results, baseline, tolerance):
+    regressions = []
+    print(f"{'benchmark':32}{'baseline':>12}{'current':>12}{'ratio':>8}")
+    for name, current in results.items():
+        if name not in baseline:
+            print(f"{name:32}{'-':>12}{current['median_ms']:12.3f}{'new':>8}")
+            continue
+        before, now = baseline[name]["median_ms"], current["median_ms"]
+        ratio = now / before if before else float("inf")
+        # The noise floor is for one timed run, benchmarks of many calls per run are judged on the whole run
+        slower = now > before * (1 + tolerance) and (now - before) * current.get("calls", 1) > MIN_REGRESSION_MS
+        print(f"{name:32}{before:12.3f}{now:12.3f}{ratio:8.2f}" + ("  REGRESSION" if slower else ""))
+        if slower:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark nordeus.py with SDL's dummy video and audio drivers.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="comma separated map sizes")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark, fewer for slow ones")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline, 0.25 is 25%%")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = run_benchmarks(sizes, args.repeat)
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pygame": pygame.version.ver,
+            "machine": platform.machine(),
+            "sizes": sizes,
+            "repeat": args.repeat,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+    if args.out:
+        with open(args.out, "w") as out_file:
+            json.dump(report, out_file, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) slower than the baseline: {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    else:
+        for name, result in results.items():
+            print(f"{name:32}{result['median_ms']:12.3f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+#
+# Monte Carlo calibration of the 'easy' and 'hard' map generators.
+#
+# Usage: python calibrate.py [--maps 1000000] [--difficulty easy hard] [--size 30] [-j WORKERS]
+#                            [--seed S] [--set NAME=VALUE ...] [--json report.json]
+# Example: python calibrate.py --difficulty hard --set hard_raise=2,4 --set hard_raise_cap=8
+#
+# Maps are generated across a pool of worker processes and every map is played by a few simulated players,
+# each with the game's 3 attempts:
+#   largest   guesses the biggest islands first
+#   darkest   guesses the islands whose cells look darkest first (mean of the texture level, min(height, 10))
+#   random    guesses islands at random, its win chance is min(3, islands) / islands for every map
+# The report has the win rates with their 95% intervals, how many guesses a win took, the per-map win
+# chances of the random player and the margin between the best and the second best island average.
+#
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+
+from nordeus import GENERATOR_PARAMS, GRID_SIZE, generate_maps, island_stats, label_islands
+
+ATTEMPTS = 3
+STRATEGIES = ("largest", "darkest", "random")
+TASK_MAPS = 20000  # Maps per pool task, generated GENERATE_MAPS at a time
+GENERATE_MAPS = 2000
+TEXTURE_LEVELS = 10  # Heights above this share the darkest land texture
+MARGIN_EDGES = np.concatenate([np.arange(0, 10, 0.01), np.arange(10, 1001, 1.0)])  # Fine bins where the generators land
+CHANCE_EDGES = np.linspace(0, 1, 21)
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+#Function which will be used to read the --set overrides, tuple params take comma separated values
+def parse_override(text):
+    name, separator, value = text.partition("=")
+    if not separator or name not in GENERATOR_PARAMS:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE with NAME one of {', '.join(GENERATOR_PARAMS)}")
+    default = GENERATOR_PARAMS[name]
+    try:
+        if isinstance(default, tuple):
+            parsed = tuple(type(default[0])(part) for part in value.split(","))
+            if len(parsed) != len(default):
+                raise ValueError
+        else:
+            parsed = type(default)(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{name} takes a value like {default}")
+    return name, parsed
+
+
+#Function which will be used to count the outcomes of a batch of maps, returns a dict of counters
+#All maps are stacked with a row of water between them and labeled in one pass, like generate_maps does
+def play_maps(maps):
+    count, rows, cols = maps.shape
+    stacked = np.zeros((count, rows + 1, cols), dtype=maps.dtype)
+    stacked[:, :rows] = maps
+    heights = stacked.reshape(count * (rows + 1), cols)
+    labels, island_count = label_islands(heights)
+    sums, sizes, averages = island_stats(heights, labels, island_count)
+    land = labels > 0
+    island_map = np.zeros(island_count + 1, dtype=np.int64)
+    island_map[labels[land]] = np.nonzero(land)[0] // (rows + 1)
+    island_map, sizes, averages = island_map[1:], sizes[1:], averages[1:]
+    island_labels = np.arange(island_count)
+    islands_per_map = np.bincount(island_map, minlength=count)
+    played = islands_per_map > 0
+
+    # Target of every map, the first island with the greatest average like Game picks it
+    order = np.lexsort((island_labels, -averages, island_map))
+    first = np.ones(order.size, dtype=bool)
+    first[1:] = island_map[order[1:]] != island_map[order[:-1]]
+    target = np.zeros(count, dtype=np.int64)
+    target[island_map[order[first]]] = order[first]
+    best = np.full(count, -np.inf)
+    best[island_map[order[first]]] = averages[order[first]]
+
+    # Runner-up average, maps with a single island have no margin
+    runner_up = np.full(count, -np.inf)
+    others = np.ones(island_count, dtype=bool)
+    others[target[played]] = False
+    np.maximum.at(runner_up, island_map[others], averages[others])
+    margins = (best - runner_up)[islands_per_map > 1]
+
+    # Guesses a player needs is one plus the islands its order puts before the target
+    shade = np.bincount(labels[land], weights=np.minimum(heights[land], TEXTURE_LEVELS), minlength=island_count + 1)[1:] / sizes
+    target_of = target[island_map]
+    by_size = (sizes > sizes[target_of]) | ((sizes == sizes[target_of]) & (island_labels < target_of))
+    by_shade = (shade > shade[target_of]) | ((shade == shade[target_of]) & by_size)
+    guesses = {strategy: np.bincount(island_map, weights=ahead, minlength=count)[played].astype(np.int64) + 1
+               for strategy, ahead in (("largest", by_size), ("darkest", by_shade))}
+
+    chances = np.minimum(ATTEMPTS, islands_per_map[played]) / islands_per_map[played]
+    return {
+        "maps": count,
+        "empty": int(count - played.sum()),
+        "islands": int(island_count),
+        "guesses": {strategy: np.bincount(np.minimum(needed, ATTEMPTS + 1), minlength=ATTEMPTS + 2) for strategy, needed in guesses.items()},
+        "random_wins": float(chances.sum()),
+        "random_wins_squared": float((chances ** 2).sum()),
+        "random_chances": np.histogram(chances, CHANCE_EDGES)[0],
+        "margins": np.histogram(margins, MARGIN_EDGES)[0],
+        "margin_overflow": int((margins >= MARGIN_EDGES[-1]).sum()),
+        "ties": int((margins == 0).sum()),
+    }
+
+
+#Function which will be used to start the counters of one difficulty, the same keys play_maps returns
+def empty_totals():
+    return {
+        "maps": 0,
+        "empty": 0,
+        "islands": 0,
+        "guesses": {strategy: np.zeros(ATTEMPTS + 2, dtype=np.int64) for strategy in ("largest", "darkest")},
+        "random_wins": 0.0,
+        "random_wins_squared": 0.0,
+        "random_chances": np.zeros(len(CHANCE_EDGES) - 1, dtype=np.int64),
+        "margins": np.zeros(len(MARGIN_EDGES) - 1, dtype=np.int64),
+        "margin_overflow": 0,
+        "ties": 0,
+    }
+
+
+#Function which will be used by the pool workers, generates and plays one task of maps
+def run_task(task):
+    difficulty, size, count, seed, params = task
+    rng = np.random.default_rng(seed)
+    totals = None
+    for start in range(0, count, GENERATE_MAPS):
+        counts = play_maps(generate_maps(min(GENERATE_MAPS, count - start), size, difficulty, rng, params))
+        totals = counts if totals is None else merge(totals, counts)
+    return difficulty, totals
+
+
+#Function which will be used to add up the counters of two batches
+def merge(totals, counts):
+    for key, value in counts.items():
+        if isinstance(value, dict):
+            for strategy, histogram in value.items():
+                totals[key][strategy] = totals[key][strategy] + histogram
+        else:
+            totals[key] = totals[key] + value
+    return totals
+
+
+#Function which will be used to read percentiles off a histogram, values are the lower edges of their bins
+def histogram_percentiles(histogram, edges, percentiles):
+    cumulative = np.cumsum(histogram)
+    if not cumulative.size or not cumulative[-1]:
+        return {percentile: None for percentile in percentiles}
+    return {percentile: float(edges[int(np.searchsorted(cumulative, cumulative[-1] * percentile / 100))])
+            for percentile in percentiles}
+
+
+#Function which will be used to turn the counters of one difficulty into the report
+def summarize(totals):
+    played = totals["maps"] - totals["empty"]
+    islands_per_map = totals["islands"] / totals["maps"] if totals["maps"] else 0.0
+    report = {"maps": totals["maps"], "empty_maps": totals["empty"], "islands_per_map": islands_per_map, "strategies": {}}
+    for strategy in STRATEGIES:
+        if strategy == "random":
+            wins = totals["random_wins"]
+            share = {"chance": {f"{edge:.2f}": int(count) for edge, count in zip(CHANCE_EDGES[1:], totals["random_chances"])}}
+        else:
+            histogram = totals["guesses"][strategy]
+            wins = float(histogram[1:ATTEMPTS + 1].sum())
+            share = {"won_on_guess": {str(guess): int(histogram[guess]) for guess in range(1, ATTEMPTS + 1)}}
+        # Without a map that has land there is nothing to win, the rate and its interval are 0
+        rate = variance = interval = 0.0
+        if played:
+            rate = wins / played
+            if strategy == "random":
+                variance = totals["random_wins_squared"] / played - rate ** 2
+            else:
+                variance = rate * (1 - rate)
+            interval = 1.96 * np.sqrt(max(variance, 0.0) / played)
+        report["strategies"][strategy] = dict({"win_rate": rate, "interval": [max(0.0, rate - interval), min(1.0, rate + interval)]}, **share)
+
+    margins = totals["margins"]
+    compared = int(margins.sum()) + totals["margin_overflow"]
+    report["margin"] = {
+        "maps": compared,
+        "ties": totals["ties"],
+        "percentiles": histogram_percentiles(np.append(margins, totals["margin_overflow"]), np.append(MARGIN_EDGES, np.inf), PERCENTILES),
+        "below_0.5": int(margins[:50].sum()),
+        "below_1": int(margins[:100].sum()),
+    }
+    return report
+
+
+def print_report(difficulty, report, elapsed):
+    print(f"{difficulty}: {report['maps']} maps in {elapsed:.1f}s, {report['islands_per_map']:.1f} islands per map, "
+          f"{report['empty_maps']} maps without land")
+    for strategy, result in report["strategies"].items():
+        low, high = result["interval"]
+        details = result.get("won_on_guess") or {}
+        guesses = ", ".join(f"{count} on guess {guess}" for guess, count in details.items())
+        print(f"  {strategy:8} win rate {result['win_rate']:7.2%}  [{low:.2%}, {high:.2%}]  {guesses}")
+    chances = report["strategies"]["random"]["chance"]
+    print("  random   per-map chance " + " ".join(f"<={edge}:{count}" for edge, count in chances.items() if count))
+    margin = report["margin"]
+    if margin["maps"]:
+        percentiles = " ".join(f"p{percentile} {value:.2f}" for percentile, value in margin["percentiles"].items())
+        print(f"  margin   {percentiles}, {margin['ties']} ties, {margin['below_0.5']} below 0.5, {margin['below_1']} below 1 "
+              f"of {margin['maps']} maps with two or more islands")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure how winnable generated maps are for a few simulated players.")
+    parser.add_argument("--maps", type=int, default=1000000, help="maps per difficulty")
+    parser.add_argument("--difficulty", nargs="+", choices=["easy", "hard"], default=["easy", "hard"])
+    parser.add_argument("--size", type=int, default=GRID_SIZE)
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--set", dest="overrides", type=parse_override, action="append", default=[], metavar="NAME=VALUE",
+                        help=f"override a generator param: {', '.join(GENERATOR_PARAMS)}")
+    parser.add_argument("--json", metavar="PATH", help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    params = dict(args.overrides)
+    # Every task gets its own seed, so a run gives the same maps whatever the number of workers
+    tasks = []
+    for index, difficulty in enumerate(args.difficulty):
+        counts = [min(TASK_MAPS, args.maps - start) for start in range(0, args.maps, TASK_MAPS)]
+        seeds = np.random.SeedSequence([args.seed, index]).spawn(len(counts))
+        tasks += [(difficulty, args.size, count, seed, params) for count, seed in zip(counts, seeds)]
+
+    totals = {difficulty: empty_totals() for difficulty in args.difficulty}
+    started = time.perf_counter()
+    with multiprocessing.Pool(args.workers) as pool:
+        for done, (difficulty, counts) in enumerate(pool.imap_unordered(run_task, tasks), 1):
+            totals[difficulty] = merge(totals[difficulty], counts)
+            print(f"\r{done}/{len(tasks)} tasks", end="", file=sys.stderr)
+    print(file=sys.stderr)
+    elapsed = time.perf_counter() - started
+
+    reports = {difficulty: summarize(totals[difficulty]) for difficulty in args.difficulty}
+    for difficulty, report in reports.items():
+        print_report(difficulty, report, elapsed)
+    print(f"{args.maps * len(args.difficulty) / elapsed:.0f} maps per second with {args.workers} workers")
+    if args.json:
+        with open(args.json, "w") as out_file:
+            json.dump({"size": args.size, "seed": args.seed, "params": dict(GENERATOR_PARAMS, **params), "reports": reports}, out_file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
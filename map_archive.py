@@ -0,0 +1,250 @@
+#
+# Compact binary archive of maps, read through mmap so a map is opened without parsing or copying.
+#
+# Usage: python map_archive.py pack OUT.nmap [MAP FILES...] [--generate N --size 30 --difficulty hard --seed S] [--fetch N]
+#        python map_archive.py info ARCHIVE.nmap
+#        python map_archive.py extract ARCHIVE.nmap INDEX
+#
+# Layout (little-endian):
+#   header   magic "NMAP", version u16, reserved u16, map count u32, index offset u64
+#   heights  every map as rows*cols uint16 values, row-major, one after the other
+#   index    one INDEX_DTYPE record per map: map id, offset, shape, source and the precomputed answer
+# The map id is a hash of the shape and heights, so the same map is only stored once.
+#
+
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+import requests
+
+from nordeus import GRID_SIZE, NORDEUS_MAP_URL, GameApp, generate_batch, read_matrix, solve_map
+
+ARCHIVE_SUFFIX = ".nmap"
+MAGIC = b"NMAP"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIQ")
+SOURCES = ("generated", "nordeus", "file")
+DIFFICULTIES = ("easy", "hard", "nordeus", "unknown")
+INDEX_DTYPE = np.dtype([
+    ("id", "<u8"),
+    ("offset", "<u8"),
+    ("rows", "<u4"),
+    ("cols", "<u4"),
+    ("source", "u1"),
+    ("difficulty", "u1"),
+    ("seed", "<i8"),  # -1 when the map was not generated from its own seed
+    ("islands", "<u4"),
+    ("x", "<i4"),  # First cell of the winning island, -1 without islands
+    ("y", "<i4"),
+    ("size", "<u4"),
+    ("average", "<f8"),  # NaN without islands
+    ("margin", "<f8"),  # NaN with fewer than two islands
+])
+
+
+#Function which will be used to compute the id of a map from its shape and heights
+def map_id(heights):
+    heights = np.ascontiguousarray(heights, dtype="<u2")
+    digest = hashlib.blake2b(struct.pack("<II", *heights.shape) + heights.tobytes(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+#Class which will be used to write an archive, maps are appended and the index is written on close
+class MapArchiveWriter:
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0))
+        self.records = []
+        self.ids = set()
+
+    def add(self, heights, source="file", difficulty="unknown", seed=-1):
+        # Returns the map id, or None when the archive already has the map
+        heights = np.ascontiguousarray(heights, dtype="<u2")
+        identifier = map_id(heights)
+        if identifier in self.ids:
+            return None
+        result = solve_map(heights)
+        self.records.append((
+            identifier, self.file.tell(), heights.shape[0], heights.shape[1], SOURCES.index(source), DIFFICULTIES.index(difficulty), seed,
+            result["islands"], -1 if result["x"] is None else result["x"], -1 if result["y"] is None else result["y"], result["size"],
+            np.nan if result["average"] is None else result["average"], np.nan if result["margin"] is None else result["margin"],
+        ))
+        self.ids.add(identifier)
+        self.file.write(heights.tobytes())
+        return identifier
+
+    def close(self):
+        index_offset = self.file.tell()
+        self.file.write(np.array(self.records, dtype=INDEX_DTYPE).tobytes())
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, 0, len(self.records), index_offset))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+#Class which will be used to read an archive through mmap
+#Heights are read-only views into the mapped file, nothing is parsed or copied until a caller copies them
+class MapArchive:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as archive_file:
+            self.mmap = mmap.mmap(archive_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mmap) < HEADER.size:
+            raise ValueError(f"{path}: too short for a map archive")
+        magic, version, _, count, index_offset = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: not a version {VERSION} map archive")
+        self.index = np.frombuffer(self.mmap, dtype=INDEX_DTYPE, count=count, offset=index_offset)
+        self._positions = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, index):
+        return self.heights(index)
+
+    def heights(self, index):
+        record = self.index[index]
+        rows, cols = int(record["rows"]), int(record["cols"])
+        return np.frombuffer(self.mmap, dtype="<u2", count=rows * cols, offset=int(record["offset"])).reshape(rows, cols)
+
+    def info(self, index):
+        # The stored answer in the same form solve_map returns it
+        record = self.index[index]
+        found = record["islands"] > 0
+        return {
+            "id": f"{int(record['id']):016x}",
+            "shape": (int(record["rows"]), int(record["cols"])),
+            "source": SOURCES[record["source"]],
+            "difficulty": DIFFICULTIES[record["difficulty"]],
+            "seed": int(record["seed"]) if record["seed"] >= 0 else None,
+            "islands": int(record["islands"]),
+            "x": int(record["x"]) if found else None,
+            "y": int(record["y"]) if found else None,
+            "size": int(record["size"]),
+            "average": float(record["average"]) if found else None,
+            "margin": float(record["margin"]) if record["islands"] > 1 else None,
+        }
+
+    def find(self, identifier):
+        # Position of a map id (an int or a hex string), None when the archive does not have it
+        if self._positions is None:
+            self._positions = {int(value): position for position, value in enumerate(self.index["id"])}
+        return self._positions.get(int(identifier, 16) if isinstance(identifier, str) else identifier)
+
+    def close(self):
+        # While views returned by heights are still in use the mapping stays open, it goes away with the last of them
+        self.index = None
+        try:
+            self.mmap.close()
+        except BufferError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+#Function which will be used to tell archives apart from text map files
+def is_archive(path):
+    if path.endswith(ARCHIVE_SUFFIX):
+        return True
+    try:
+        with open(path, "rb") as map_file:
+            return map_file.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def pack(args):
+    added = skipped = 0
+    with MapArchiveWriter(args.archive) as writer:
+        def add(heights, **metadata):
+            nonlocal added, skipped
+            if writer.add(heights, **metadata) is None:
+                skipped += 1
+            else:
+                added += 1
+
+        for path in args.maps:
+            add(read_matrix(path), source="file")
+        if args.generate:
+            for heights in generate_batch(args.generate, args.size, args.difficulty, args.seed):
+                add(heights, source="generated", difficulty=args.difficulty)
+        if args.fetch:
+            with requests.Session() as session:
+                for _ in range(args.fetch):
+                    add(GameApp.fetch_matrix(args.url, session), source="nordeus", difficulty="nordeus")
+    print(f"{args.archive}: {added} maps added, {skipped} duplicates skipped")
+    return 0
+
+
+def info(args):
+    archive = MapArchive(args.archive)
+    counts = {}
+    for record in archive.index:
+        key = (SOURCES[record["source"]], DIFFICULTIES[record["difficulty"]], int(record["rows"]), int(record["cols"]))
+        counts[key] = counts.get(key, 0) + 1
+    print(f"{args.archive}: {len(archive)} maps, {os.path.getsize(args.archive)} bytes")
+    for (source, difficulty, rows, cols), count in sorted(counts.items()):
+        print(f"  {count:8} {source:10} {difficulty:8} {rows}x{cols}")
+    archive.close()
+    return 0
+
+
+def extract(args):
+    archive = MapArchive(args.archive)
+    position = archive.find(args.map) if len(args.map) == 16 else int(args.map)
+    if position is None or not 0 <= position < len(archive):
+        print(f"{args.archive} has no map {args.map}", file=sys.stderr)
+        return 1
+    # Same text format as the Nordeus endpoint
+    for row in archive.heights(position).tolist():
+        print(" ".join(map(str, row)))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pack maps into a memory-mapped binary archive and inspect archives.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    pack_parser = commands.add_parser("pack", help="create an archive")
+    pack_parser.add_argument("archive")
+    pack_parser.add_argument("maps", nargs="*", help="text map files to add, gzip compressed or not")
+    pack_parser.add_argument("--generate", type=int, default=0, metavar="N", help="add N generated maps")
+    pack_parser.add_argument("--size", type=int, default=GRID_SIZE)
+    pack_parser.add_argument("--difficulty", choices=["easy", "hard"], default="hard")
+    pack_parser.add_argument("--seed", type=int, default=None)
+    pack_parser.add_argument("--fetch", type=int, default=0, metavar="N", help="download N maps from the Nordeus endpoint")
+    pack_parser.add_argument("--url", default=NORDEUS_MAP_URL)
+    pack_parser.set_defaults(run=pack)
+
+    info_parser = commands.add_parser("info", help="count the maps of an archive")
+    info_parser.add_argument("archive")
+    info_parser.set_defaults(run=info)
+
+    extract_parser = commands.add_parser("extract", help="print one map as text")
+    extract_parser.add_argument("archive")
+    extract_parser.add_argument("map", help="position in the archive, or the 16 digit hex map id")
+    extract_parser.set_defaults(run=extract)
+
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
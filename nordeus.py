@@ -4,10 +4,24 @@
 
 
 
+import time
+startup_started = time.perf_counter()  # The startup trace counts from the first import
 import pygame
+pygame_imported = time.perf_counter()
 import random
 import os
-import requests
+import io
+import csv
+import json
+import argparse
+import contextlib
+import collections
+import queue
+import threading
+import zlib
+import numpy as np
+modules_imported = time.perf_counter()
+# requests is imported by the first Nordeus map download, most sessions never need it
 
 # Constants for colors and dimensions
 CELL_SIZE = 20
@@ -18,9 +32,33 @@ BLUE = (0, 0, 255)
 LIGHT_BROWN = (222, 184, 135)
 BROWN_DARKEN_STEP = 10
 GREEN = (0, 255, 0)
+BLACK = (0, 0, 0)
 RED = (255, 0, 0)
 FONT_SIZE = 20
 RESTART_DELAY = 3000
+ACTIVE_FPS = 30  # Frame rate while something on screen moves
+IDLE_WAKE_MS = 500  # Longest sleep in idle mode, so timers and downloads are still checked
+MESSAGE_Y = WINDOW_SIZE - 30
+HOVER_MESSAGE_Y = WINDOW_SIZE - 60
+TEXT_STRIPS = [(0, MESSAGE_Y, WINDOW_SIZE, FONT_SIZE), (0, HOVER_MESSAGE_Y, WINDOW_SIZE, FONT_SIZE)]
+CLOUD_SHADOW_OFFSET = (10, 8)
+CLOUD_COUNT = 3
+CLOUD_SIZE = (64, 32)
+
+# Camera and chunked map rendering, the window shows part of bigger maps
+ZOOM_CELL_SIZES = (1, 2, 3, 4, 6, 8, 10, 14, 20, 28, 40)  # Pixels per cell at each zoom level
+CHUNK_PIXELS = 512  # Rough side of a pre-rendered chunk at any zoom level
+CHUNK_CACHE_BYTES = 64 * 1024 * 1024  # Memory cap of the chunk cache
+PAN_SPEED = 12  # Pixels per frame while an arrow or WASD key is held
+TERRAIN_EDIT_LOG = 256  # Cell edits remembered per map, more edits between two frames redraw every chunk
+SPLIT_SEARCH_CELLS = 16384  # Cells the flood fills of a removed cell may visit before its island's bounding box is relabeled
+ISLAND_STYLES = {  # Fill and outline colours of island overlays, with alpha
+    'win': (GREEN + (255,), (0, 128, 0, 255)),
+    'plain': (LIGHT_BROWN + (255,), LIGHT_BROWN + (255,)),
+    'hover': ((255, 255, 255, 60), (255, 255, 255, 230)),
+}
+OUTLINE_WIDTH = 2  # Pixels
+ISLAND_OVERLAY_CACHE = 16  # Island overlays kept per view
 BUTTON_WIDTH = 100
 BUTTON_HEIGHT = 20
 BUTTON_NORDEUS_COLOR = (231, 72, 42)
@@ -30,275 +68,1627 @@ BUTTON_COLOR = BUTTON_NORDEUS_COLOR
 BUTTON_NORDEUS_HOVER_COLOR = (231, 152, 42)
 
 BUTTON_HOVER_COLOR = BUTTON_NORDEUS_HOVER_COLOR
-
-#Class which will be used to create the clouds
-class Cloud:
-    def __init__(self, image, x, y, speed, shadow):
-        self.image = image
-        self.x = x
-        self.y = y
-        self.speed = speed
-        self.shadow = shadow 
+TEXT_CACHE_SIZE = 256  # Rendered strings kept by the text cache
+
+# Nordeus maps are downloaded in the background, NORDEUS_MAP_URL can point the game at a local stub server
+NORDEUS_MAP_URL = os.environ.get("NORDEUS_MAP_URL", "https://jobfair.nordeus.com/jf24-fullstack-challenge/test")
+FETCH_TIMEOUT = (3.05, 10)  # Connect and read timeouts in seconds
+FETCH_BACKOFF = 0.5  # First wait after a failed download in seconds, doubled on every failure
+FETCH_BACKOFF_MAX = 30
+PREFETCH_SIZE = 2  # Maps kept ready in the queue
+FETCH_MAX_CELLS = 4000 * 4000  # Bigger downloaded maps are rejected while they are read
+
+# Sound effects as name: (file in the sound folder, volume), each one gets its own reserved mixer channel
+SOUND_EFFECTS = {
+    'correct': ('correct.ogg', 0.3),
+    'wrong': ('wrong.ogg', 0.1),
+}
+MUSIC_FILES = ['track1.ogg', 'track2.ogg', 'track3.ogg']
+
+# Frame profiler, F3 shows the overlay
+PROFILE_WINDOW = 300  # Frames kept for the rolling percentiles
+PROFILE_PERCENTILES = (50, 95, 99)
+OVERLAY_REFRESH = 15  # Frames between overlay text updates
+MAP_WAIT_LIMIT = 10000  # Milliseconds to wait for a Nordeus map before falling back to a generated one
+MAP_POLL_MS = 100  # Longest idle sleep while the loading screen waits for a map
+
+# Session recordings, see SessionRecorder and replay.py
+RECORDING_VERSION = 1
+RECORDED_EVENTS = (pygame.QUIT, pygame.KEYDOWN, pygame.KEYUP, pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP, pygame.MOUSEMOTION, pygame.MOUSEWHEEL)
+RECORDED_EVENT_FIELDS = ('pos', 'rel', 'buttons', 'button', 'key', 'x', 'y')
+PAN_KEYS = {pygame.K_LEFT: (-1, 0), pygame.K_a: (-1, 0), pygame.K_RIGHT: (1, 0), pygame.K_d: (1, 0),
+            pygame.K_UP: (0, -1), pygame.K_w: (0, -1), pygame.K_DOWN: (0, 1), pygame.K_s: (0, 1)}
+
+# Heights are 0..1000 so two bytes per cell are enough, island labels need four
+MAX_HEIGHT = 1000
+HEIGHT_DTYPE = np.uint16
+PARSE_CHUNK_BYTES = 1 << 20  # Map text is parsed this much at a time
+GZIP_MAGIC = b"\x1f\x8b"
+MAP_TEXT_BYTES = b"0123456789 \t\r\n"  # Everything else in map text is an error
+LABEL_DTYPE = np.int32
+
+# Cells get darker with height until they reach half brightness at height 10
+DARKEN_STEP = 0.05
+DARKEN_MIN_FACTOR = 0.5
+DARKEN_FACTORS = [max(DARKEN_MIN_FACTOR, 1 - level * DARKEN_STEP) for level in range(11)]
+
+
+def darkening_factor(height):
+    return max(DARKEN_MIN_FACTOR, 1 - height * DARKEN_STEP)
+
+
+#Function which will be used to label the islands of a height array
+#Returns (labels, count), labels is 0 for water and 1..count for land, numbered in row-major order of first appearance
+def label_islands(heights):
+    land = np.asarray(heights) > 0
+    rows, cols = land.shape
+    labels = np.zeros((rows, cols), dtype=LABEL_DTYPE)
+    if not land.any():
+        return labels, 0
+
+    # Every horizontal run of land gets an id, so only vertical neighbours are left to join
+    starts = land.copy()
+    starts[:, 1:] &= ~land[:, :-1]
+    run_id = (np.cumsum(starts, dtype=LABEL_DTYPE) - 1).reshape(rows, cols)
+    runs = int(run_id[land].max()) + 1
+
+    touching = land[:-1, :] & land[1:, :]
+    upper = run_id[:-1, :][touching]
+    lower = run_id[1:, :][touching]
+    if upper.size:
+        # Consecutive cells of the same two runs give the same edge, keep only one of them
+        keep = np.ones(upper.size, dtype=bool)
+        keep[1:] = (upper[1:] != upper[:-1]) | (lower[1:] != lower[:-1])
+        upper, lower = upper[keep], lower[keep]
+
+    # Union-find over runs: hook the larger root onto the smaller one, then flatten with pointer jumping
+    parent = np.arange(runs, dtype=LABEL_DTYPE)
+    while upper.size:
+        root_upper, root_lower = parent[upper], parent[lower]
+        apart = root_upper != root_lower
+        if not apart.any():
+            break
+        upper, lower = upper[apart], lower[apart]
+        root_upper, root_lower = root_upper[apart], root_lower[apart]
+        parent[np.maximum(root_upper, root_lower)] = np.minimum(root_upper, root_lower)
+        while True:
+            jumped = parent[parent]
+            if np.array_equal(jumped, parent):
+                break
+            parent = jumped
+
+    # Roots are the first run of every island, so ranking them keeps the scan order
+    rank = np.cumsum(parent == np.arange(runs), dtype=LABEL_DTYPE)
+    labels[land] = rank[parent[run_id[land]]]
+    return labels, int(rank[-1])
+
+
+#Function which will be used to compute the height sum, cell count and average of every label
+#Index 0 of each array is the water
+def island_stats(heights, labels, count):
+    flat_labels = labels.ravel()
+    sums = np.bincount(flat_labels, weights=np.asarray(heights).ravel(), minlength=count + 1).astype(np.int64)
+    sizes = np.bincount(flat_labels, minlength=count + 1)
+    averages = sums / np.maximum(sizes, 1)
+    averages[0] = 0
+    return sums, sizes, averages
+
+
+#Function which will be used to answer the game question for a height array without any sprites
+#Returns a dict with the winning island, its average and the margin over the runner-up island
+def solve_map(heights):
+    heights = np.asarray(heights)
+    labels, count = label_islands(heights)
+    sums, sizes, averages = island_stats(heights, labels, count)
+    result = {"islands": count, "label": None, "x": None, "y": None, "size": 0, "average": None, "margin": None}
+    if not count:
+        return result
+
+    # First island with the greatest average, the same one Game picks as the target
+    winner = int(np.argmax(averages[1:])) + 1
+    x, y = divmod(int(np.argmax(labels.ravel() == winner)), heights.shape[1])
+    result.update(label=winner, x=x, y=y, size=int(sizes[winner]), average=float(averages[winner]))
+    if count > 1:
+        others = np.delete(averages[1:], winner - 1)
+        result["margin"] = float(averages[winner] - others.max())
+    return result
+
+
+#Class which will be used to parse map text (rows of space separated heights) as it streams in
+#Chunks of any size are fed in, gzip input is detected and decompressed, and only whole lines are parsed,
+#so memory follows the height array and not the text. Rows and columns in errors count from 0.
+class MapParser:
+    def __init__(self, max_cells=None):
+        self.max_cells = max_cells
+        self.decompressor = None
+        self.started = False  # The first bytes decide between plain text and gzip
+        self.pending = bytearray()  # Text that is not parsed yet, whole lines are parsed once there is enough of it
+        self.blocks = []  # Parsed rows, one (rows, cols) array per block
+        self.rows = 0
+        self.cols = None
+        self.blank_row = None  # Row index of an empty line after the first row, an error unless only empty lines follow
+
+    def feed(self, chunk):
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        if not self.started:
+            self.pending += chunk
+            if len(self.pending) < len(GZIP_MAGIC):
+                return
+            chunk, self.pending, self.started = bytes(self.pending), bytearray(), True
+            if chunk.startswith(GZIP_MAGIC):
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self.decompressor is not None:
+            chunk = self.decompress(chunk)
+
+        # Text is collected until a block is worth parsing, small maps are parsed once by finish
+        self.pending += chunk
+        if len(self.pending) < PARSE_CHUNK_BYTES:
+            return
+        end = self.pending.rfind(b"\n") + 1
+        if end:
+            data = bytes(self.pending[:end])
+            del self.pending[:end]
+            self.parse_lines(data)
+
+    def decompress(self, chunk):
+        # Concatenated gzip members are read one after the other, like gzip.open does
+        try:
+            parts = [self.decompressor.decompress(chunk)]
+            while self.decompressor.eof and self.decompressor.unused_data:
+                rest = self.decompressor.unused_data
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                parts.append(self.decompressor.decompress(rest))
+        except zlib.error as e:
+            raise ValueError(f"The gzip stream is corrupt: {e}") from e
+        return b"".join(parts)
+
+    def finish(self):
+        if not self.started:
+            self.started = True
+            if self.pending.startswith(GZIP_MAGIC):
+                raise ValueError("The gzip stream is truncated.")
+        elif self.decompressor is not None and not self.decompressor.eof:
+            raise ValueError("The gzip stream is truncated.")
+        if self.pending:
+            self.parse_lines(bytes(self.pending))
+            self.pending = bytearray()
+        if not self.rows:
+            raise ValueError("The matrix is empty.")
+        heights = self.blocks[0] if len(self.blocks) == 1 else np.concatenate(self.blocks)
+        self.blocks = []
+        return heights
+
+    def parse_lines(self, data):
+        # Parses whole lines with array operations on the bytes, the last line may lack its newline
+        # A separator is put in front, so looking back from any digit never leaves the text
+        if data.translate(None, MAP_TEXT_BYTES):
+            # Lines before the bad character are checked first, so the earliest error is the one reported
+            position = len(data) - len(data.lstrip(MAP_TEXT_BYTES))
+            line_start = data.rfind(b"\n", 0, position) + 1
+            if line_start:
+                self.parse_lines(data[:line_start])
+            column = len(data[line_start:position].split())
+            if data[position - 1:position].isdigit() and position > line_start:
+                column -= 1  # The character is part of the number before it, like the 'a' of 12a
+            character = data[position:position + 1].decode("latin-1")
+            raise ValueError(f"Row {self.rows}, column {column}: unexpected character {character!r}.")
+
+        text = np.frombuffer(b" " + data, dtype=np.uint8)
+        digits = text - np.uint8(48)  # Digits become 0..9, every other byte something larger
+        digit = digits < 10
+
+        # Numbers start and end where digits and separators alternate, the text starts with a separator
+        edges = np.flatnonzero(digit[1:] != digit[:-1])
+        if digit[-1]:
+            edges = np.append(edges, len(digit) - 1)
+        starts, ends = edges[0::2] + 1, edges[1::2] + 1  # Indices into text, ends are exclusive
+        newlines = np.flatnonzero(text == 10)
+        line_ends = np.searchsorted(starts, newlines)
+        if not data.endswith(b"\n"):
+            line_ends = np.append(line_ends, len(starts))
+        counts = np.diff(line_ends, prepend=0)
+
+        # Empty lines are only allowed before the first row and after the last one
+        filled = np.flatnonzero(counts)
+        if len(filled):
+            if self.blank_row is not None:
+                raise ValueError(f"Row {self.blank_row} has 0 values, expected {self.cols}.")
+            first = 0 if self.rows else filled[0]
+            gaps = np.flatnonzero(counts[first:filled[-1]] == 0)
+            if len(gaps):
+                row = self.rows + int(np.count_nonzero(counts[first:first + gaps[0]]))
+                raise ValueError(f"Row {row} has 0 values, expected {self.cols or int(counts[filled[0]])}.")
+            if self.cols is None:
+                self.cols = int(counts[filled[0]])
+            wrong = np.flatnonzero(counts[filled] != self.cols)
+            if len(wrong):
+                raise ValueError(f"Row {self.rows + int(wrong[0])} has {int(counts[filled[wrong[0]]])} values, expected {self.cols}.")
+        if (self.rows or len(filled)) and counts[-1] == 0 and self.blank_row is None:
+            self.blank_row = self.rows + len(filled)
+        if not len(filled):
+            return
+        if self.max_cells is not None and (self.rows + len(filled)) * self.cols > self.max_cells:
+            raise ValueError(f"The matrix has more than {self.max_cells} cells.")
+
+        # Heights have at most 4 digits, each number adds up its last digits, longer numbers are converted one by one
+        last = ends - 1
+        lengths = ends - starts
+        values = digits.take(last).astype(np.int32)
+        for place in range(1, 4):
+            longer = np.flatnonzero(lengths > place)
+            values[longer] += 10 ** place * digits.take(last[longer] - place).astype(np.int32)
+        long = np.flatnonzero(lengths > 4)
+        values[long] = [min(int(data[start - 1:end - 1]), MAX_HEIGHT + 1) for start, end in zip(starts[long].tolist(), ends[long].tolist())]
+        out_of_range = values > MAX_HEIGHT
+        if out_of_range.any():
+            index = int(np.argmax(out_of_range))
+            line = int(np.searchsorted(line_ends, index, side="right"))
+            row = self.rows + int(np.searchsorted(filled, line))
+            column = index - (int(line_ends[line - 1]) if line else 0)
+            raise ValueError(f"Row {row}, column {column}: height {data[starts[index] - 1:ends[index] - 1].decode()} is outside 0..{MAX_HEIGHT}.")
+
+        self.blocks.append(values.astype(HEIGHT_DTYPE).reshape(len(filled), self.cols))
+        self.rows += len(filled)
+
+
+#Function which will be used to read a map from a path, bytes, a file object or an iterable of chunks such as an HTTP body
+#Returns a (rows, cols) HEIGHT_DTYPE array that GridMap uses without copying
+def read_matrix(source, max_cells=None, chunk_size=PARSE_CHUNK_BYTES):
+    parser = MapParser(max_cells)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        parser.feed(bytes(source))
+    elif isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as map_file:
+            for chunk in iter(lambda: map_file.read(chunk_size), b""):
+                parser.feed(chunk)
+    elif hasattr(source, "read"):
+        for chunk in iter(lambda: source.read(chunk_size), source.read(0)):
+            parser.feed(chunk)
+    else:
+        for chunk in source:
+            parser.feed(chunk)
+    return parser.finish()
+
+
+#Function which will be used to turn map text into a height array, see MapParser
+def parse_matrix(text):
+    return read_matrix(text.encode() if isinstance(text, str) else text)
+
+
+# Shape of the generated maps, the same numbers the per-cell generator used
+LAND_CHANCE = 0.2
+BASE_HEIGHTS = (1, 5)
+EASY_TARGET_HEIGHT = 10
+HARD_BOOST_HEIGHTS = (7, 10)
+HARD_RAISE = (3, 5)
+HARD_RAISE_CAP = 9
+HARD_SINGLE_CAP = (1, 7)
+GENERATE_BATCH_SIZE = 1000  # Maps generated together by generate_batch
+GENERATOR_PARAMS = {  # Defaults of the params argument of generate_maps, calibrate.py tries other values
+    'land_chance': LAND_CHANCE,
+    'base_heights': BASE_HEIGHTS,
+    'easy_target_height': EASY_TARGET_HEIGHT,
+    'hard_boost_heights': HARD_BOOST_HEIGHTS,
+    'hard_raise': HARD_RAISE,
+    'hard_raise_cap': HARD_RAISE_CAP,
+    'hard_single_cap': HARD_SINGLE_CAP,
+}
+
+
+#Function which will be used to generate several 'easy' or 'hard' maps at once with array operations
+#Returns an array of shape (count, rows, cols), the same seed always gives the same maps
+#params overrides some of GENERATOR_PARAMS
+def generate_maps(count, size=GRID_SIZE, difficulty='easy', seed=None, params=None):
+    unknown = set(params or ()) - set(GENERATOR_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown generator params: {', '.join(sorted(unknown))}")
+    params = dict(GENERATOR_PARAMS, **(params or {}))
+    rng = np.random.default_rng(seed)
+    rows, cols = (size, size) if np.isscalar(size) else size
+
+    # All maps are stacked with a row of water between them, so one labeling pass covers the whole batch
+    stack_shape = (count, rows + 1, cols)
+    heights = np.where(rng.random(stack_shape) < params['land_chance'], rng.integers(params['base_heights'][0], params['base_heights'][1] + 1, stack_shape), 0)
+    heights[:, rows, :] = 0
+    heights = heights.reshape(count * (rows + 1), cols)
+    labels, island_count = label_islands(heights)
+    sums, sizes, averages = island_stats(heights, labels, island_count)
+
+    # Islands are numbered in scan order, so every map owns a contiguous range of labels
+    land = labels > 0
+    island_map = np.full(island_count + 1, -1)
+    island_map[labels[land]] = np.nonzero(land)[0] // (rows + 1)
+    island_labels = np.arange(1, island_count + 1)
+
+    # Largest island of every map, the first one on ties
+    order = np.lexsort((island_labels, -sizes[1:], island_map[1:]))
+    first = np.ones(order.size, dtype=bool)
+    first[1:] = island_map[1:][order[1:]] != island_map[1:][order[:-1]]
+    largest = np.zeros(island_count + 1, dtype=bool)
+    largest[island_labels[order[first]]] = True
+    largest_of_map = np.zeros(count, dtype=np.int64)
+    largest_of_map[island_map[largest]] = np.flatnonzero(largest)
+
+    if difficulty == 'easy':
+        heights[largest[labels]] = params['easy_target_height']
+    else:
+        # Make one random island of those sharing the average of the largest one slightly taller
+        tied = np.zeros(island_count + 1, dtype=bool)
+        tied[1:] = averages[1:] == averages[largest_of_map[np.maximum(island_map[1:], 0)]]
+        tied_per_map = np.bincount(island_map[tied], minlength=count)
+        candidates = tied & (tied_per_map[np.maximum(island_map, 0)] > 1)
+        candidates[0] = False
+        keys = np.where(candidates, rng.random(island_count + 1), -1.0)
+        order = np.lexsort((-keys[1:], island_map[1:]))
+        first = np.ones(order.size, dtype=bool)
+        first[1:] = island_map[1:][order[1:]] != island_map[1:][order[:-1]]
+        boosted = np.zeros(island_count + 1, dtype=bool)
+        picked = island_labels[order[first]]
+        boosted[picked[candidates[picked]]] = True
+        boosted_cells = boosted[labels]
+        heights[boosted_cells] = rng.integers(params['hard_boost_heights'][0], params['hard_boost_heights'][1] + 1, heights.shape)[boosted_cells]
+
+        # Raise the other islands, single cells only get lower
+        others = land & ~largest[labels]
+        multi = others & (sizes[labels] > 1)
+        raise_by = rng.integers(params['hard_raise'][0], params['hard_raise'][1] + 1, heights.shape)
+        heights[multi] = np.minimum(params['hard_raise_cap'], heights[multi] + raise_by[multi])
+        single = others & (sizes[labels] == 1)
+        caps = rng.integers(params['hard_single_cap'][0], params['hard_single_cap'][1] + 1, heights.shape)
+        heights[single] = np.minimum(heights[single], caps[single])
+
+    return heights.reshape(count, rows + 1, cols)[:, :rows, :].astype(HEIGHT_DTYPE)
+
+
+#Function which will be used to generate one map, see generate_maps
+def generate_heights(size=GRID_SIZE, difficulty='easy', seed=None):
+    return generate_maps(1, size, difficulty, seed)[0]
+
+
+#Function which will be used to stream any number of maps, generated GENERATE_BATCH_SIZE at a time
+def generate_batch(count, size=GRID_SIZE, difficulty='easy', seed=None, batch_size=GENERATE_BATCH_SIZE, params=None):
+    rng = np.random.default_rng(seed)
+    remaining = count
+    while remaining > 0:
+        batch = generate_maps(min(batch_size, remaining), size, difficulty, rng, params)
+        remaining -= len(batch)
+        yield from batch
+
+#Class which will be used to move and draw many sprites at once, the clouds and any other ambient effect
+#Positions and velocities are arrays updated in one step, and all sprites are drawn through one Surface.blits call
+class SpriteLayer:
+    def __init__(self, bounds=(WINDOW_SIZE, WINDOW_SIZE), shadow_offset=(0, 0)):
+        self.width, self.height = bounds
+        self.shadow_offset = shadow_offset
+        self.variants = []  # (image, shadow or None), shadows have the size of their image
+        self.variant_index = {}  # (image, shadow, flip x, flip y): index into variants
+        self.sizes = np.zeros((0, 2))  # Width and height of every variant
+        self.shadowed = np.zeros(0, dtype=bool)  # Variants with a shadow
+        self.positions = np.zeros((0, 2))
+        self.velocities = np.zeros((0, 2))  # Pixels per frame
+        self.kinds = np.zeros(0, dtype=np.intp)  # Variant of every sprite
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def variant(self, image, shadow=None, flip_x=False, flip_y=False):
+        # Flipped copies are made once and shared by every sprite that uses them
+        key = (image, shadow, flip_x, flip_y)
+        if key not in self.variant_index:
+            if flip_x or flip_y:
+                image = pygame.transform.flip(image, flip_x, flip_y)
+                shadow = pygame.transform.flip(shadow, flip_x, flip_y) if shadow is not None else None
+            self.variant_index[key] = len(self.variants)
+            self.variants.append((image, shadow))
+            self.sizes = np.vstack([self.sizes, image.get_size()])
+            self.shadowed = np.append(self.shadowed, shadow is not None)
+        return self.variant_index[key]
+
+    def add(self, variant, x, y, dx, dy=0):
+        self.positions = np.vstack([self.positions, (x, y)])
+        self.velocities = np.vstack([self.velocities, (dx, dy)])
+        self.kinds = np.append(self.kinds, variant)
 
     def update(self):
-        self.x += self.speed
-        if self.x > WINDOW_SIZE:
-            self.x = -self.image.get_width()  
-
-    def draw(self, screen):
-        screen.blit(self.shadow, (self.x + 10, self.y + 8))  # Slight offset for shadow
-        screen.blit(self.image, (self.x, self.y))
+        self.positions += self.velocities
+        # Sprites that leave the bounds come back in on the other side
+        sizes = self.sizes[self.kinds]
+        x, y = self.positions[:, 0], self.positions[:, 1]
+        x[x > self.width] = -sizes[x > self.width, 0]
+        x[x < -sizes[:, 0]] = self.width
+        y[y > self.height] = -sizes[y > self.height, 1]
+        y[y < -sizes[:, 1]] = self.height
+
+    def screen_positions(self):
+        return np.floor(self.positions).astype(int)
+
+    def rects(self):
+        # Screen area covered by every sprite and its shadow
+        positions = self.screen_positions()
+        sizes = self.sizes[self.kinds].astype(int)
+        offsets = np.where(self.shadowed[self.kinds, None], self.shadow_offset, 0)
+        left_top = np.minimum(positions, positions + offsets)
+        right_bottom = np.maximum(positions, positions + offsets) + sizes
+        return list(map(pygame.Rect, np.hstack([left_top, right_bottom - left_top]).tolist()))
 
     def render(self, screen):
-        self.draw(screen)
+        # Shadows go under all sprites, then the sprites, in one batched call
+        positions = self.screen_positions().tolist()
+        kinds = self.kinds.tolist()
+        offset_x, offset_y = self.shadow_offset
+        shadows = [(self.variants[kind][1], (x + offset_x, y + offset_y)) for kind, (x, y) in zip(kinds, positions) if self.variants[kind][1] is not None]
+        screen.blits(shadows + [(self.variants[kind][0], position) for kind, position in zip(kinds, positions)], doreturn=False)
+
+
+#Class which will be used to read the game time in milliseconds
+#The time is frozen at the start of every frame, so all game logic of a frame sees the same time and replays can set it
+class GameClock:
+    def __init__(self):
+        self.now = None
+
+    def ticks(self):
+        return pygame.time.get_ticks() if self.now is None else self.now
+
+    def set(self, now):
+        # None follows the pygame clock again
+        self.now = now
+
+
+game_clock = GameClock()
+
+
+#Class which will be used to record a session as JSON lines: a header, then one line for every frame that had
+#events, started games, guesses or held pan keys, frames where nothing happened are left out
+#Without a path the records are kept in memory, replay.py uses that to compare a replay with its recording
+class SessionRecorder:
+    def __init__(self, path=None):
+        self.file = open(path, 'w') if path else None
+        self.records = []
+        self.current = None
+
+    def write(self, record):
+        if self.file:
+            self.file.write(json.dumps(record, separators=(',', ':')) + "\n")
+        else:
+            self.records.append(record)
+
+    def start(self, app):
+        self.write({"version": RECORDING_VERSION, "pygame": pygame.version.ver, "window": WINDOW_SIZE,
+                    "mouse": list(app.mouse_pos), "map_url": app.map_url})
+
+    def next_frame(self, frame, time, keep=False):
+        self.flush()
+        self.current = {"frame": frame, "time": time, "events": [], "games": [], "guesses": [], "keep": keep}
+
+    def record_events(self, events):
+        for event in events:
+            if event.type in RECORDED_EVENTS:
+                fields = {name: list(value) if isinstance(value, tuple) else value
+                          for name, value in event.dict.items() if name in RECORDED_EVENT_FIELDS}
+                self.current["events"].append([event.type, fields])
+
+    def record_game(self, game, matrix=None):
+        target = game.target_island
+        self.current["games"].append({
+            "difficulty": game.map.difficulty,
+            "seed": game.map.seed,
+            "matrix": np.asarray(matrix).tolist() if matrix is not None else None,
+            "target": [target.cells[0].x, target.cells[0].y] if target else None,
+            "average": target.average_height() if target else None,
+        })
+
+    def record_guess(self, cell, game):
+        self.current["guesses"].append({"x": cell.x, "y": cell.y, "correct": game.correct_guess, "attempts": game.attempts})
+
+    def flush(self):
+        record = self.current
+        self.current = None
+        if record and (record["events"] or record["games"] or record["guesses"] or record.pop("keep")):
+            record.pop("keep", None)
+            self.write(record)
+
+    def close(self):
+        self.flush()
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+#Function which will be used to turn a recorded event back into a pygame event
+def decode_event(event_type, fields):
+    return pygame.event.Event(event_type, {name: tuple(value) if isinstance(value, list) else value for name, value in fields.items()})
+
+
+#Class which will be used to share one font object per font file and size
+class FontRegistry:
+    def __init__(self):
+        self.fonts = {}
 
+    def get(self, size=FONT_SIZE, name=None):
+        key = (name, size)
+        if key not in self.fonts:
+            self.fonts[key] = pygame.font.Font(name, size)
+        return self.fonts[key]
+
+
+fonts = FontRegistry()
+
+
+#Class which will be used to keep rendered strings, so text that did not change is never rendered again
+#Least recently used strings are dropped once TEXT_CACHE_SIZE is reached
+class TextCache:
+    def __init__(self, size=TEXT_CACHE_SIZE):
+        self.size = size
+        self.surfaces = collections.OrderedDict()  # (text, font, color): surface, oldest first
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, text, font, color):
+        key = (text, font, color)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+        self.misses += 1
+        surface = font.render(text, True, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.size:
+            self.surfaces.popitem(last=False)
+        return surface
+
+
+text_cache = TextCache()
 
 
 #Class which will be used to create the buttons
+#Both looks of a button are drawn once, rendering only blits the one for the current hover state
 class Button:
     def __init__(self, x, y, width, height, color, text, hover_color=None):
         self.rect = pygame.Rect(x, y, width, height)
         self.color = color
         self.hover_color = hover_color if hover_color else color
         self.text = text
-        self.font = pygame.font.Font(None, FONT_SIZE)
+        self.font = fonts.get(FONT_SIZE)
+        self.surfaces = {}  # hovered: surface
+
+    def is_hovered(self):
+        return self.rect.collidepoint(pygame.mouse.get_pos())
+
+    def get_surface(self, hovered):
+        if hovered not in self.surfaces:
+            surface = pygame.Surface(self.rect.size)
+            surface.fill(self.hover_color if hovered else self.color)
+            text_surf = text_cache.render(self.text, self.font, WHITE)
+            surface.blit(text_surf, (
+                (self.rect.width - text_surf.get_width()) // 2,
+                (self.rect.height - text_surf.get_height()) // 2
+            ))
+            self.surfaces[hovered] = surface
+        return self.surfaces[hovered]
 
     def render(self, screen):
-        current_color = self.hover_color if self.rect.collidepoint(pygame.mouse.get_pos()) else self.color
-        pygame.draw.rect(screen, current_color, self.rect)
-        text_surf = self.font.render(self.text, True, WHITE)
-        screen.blit(text_surf, (
-            self.rect.x + (self.rect.width - text_surf.get_width()) // 2,
-            self.rect.y + (self.rect.height - text_surf.get_height()) // 2
-        ))
+        screen.blit(self.get_surface(self.is_hovered()), self.rect)
 
     def is_clicked(self, event):
         return event.type == pygame.MOUSEBUTTONDOWN and self.rect.collidepoint(event.pos)
     
 
+#Class which will be used to share darkened copies of sprites between all cells and maps
+class SpriteAtlas:
+    def __init__(self):
+        self.sprites = {}
+        self.tiles = {}
+
+    def build(self, sprites, factors=DARKEN_FACTORS):
+        # Done once after the sprites are loaded, so new games never darken anything
+        for sprite in sprites:
+            for factor in factors:
+                self.get(sprite, factor)
+
+    def get(self, sprite, factor):
+        key = (sprite, factor)
+        if key not in self.sprites:
+            self.sprites[key] = self.darken_sprite(sprite, factor)
+        return self.sprites[key]
+
+    def get_tiles(self, water_sprite, land_sprite, cell_size):
+        # Pixel arrays of every terrain tile at one cell size, index 0 is water and 1 + level is land of that level
+        key = (water_sprite, land_sprite, cell_size)
+        if key not in self.tiles:
+            sprites = [self.get(water_sprite, darkening_factor(0))] + [self.get(land_sprite, factor) for factor in DARKEN_FACTORS]
+            if sprites[0].get_size() != (cell_size, cell_size):
+                sprites = [pygame.transform.smoothscale(sprite, (cell_size, cell_size)) for sprite in sprites]
+            self.tiles[key] = np.stack([pygame.surfarray.array3d(sprite) for sprite in sprites])
+        return self.tiles[key]
+
+    @staticmethod
+    def darken_sprite(sprite, factor):
+        darkened_sprite = sprite.copy()
+        # Multiply the RGB channels of all pixels at once, alpha is left untouched
+        pixels = pygame.surfarray.pixels3d(darkened_sprite)
+        pixels[...] = (pixels * factor).astype(np.uint8)
+        del pixels  # Releases the lock on the surface
+        return darkened_sprite
+
+
+sprite_atlas = SpriteAtlas()
+
+
+#Class which will be used to time the imports and initialization up to the first frame
+#Phases are always recorded, the report is only printed with --trace-startup or NORDEUS_TRACE_STARTUP=1
+class StartupTrace:
+    def __init__(self, started, enabled=False):
+        self.started = started
+        self.last = started
+        self.phases = []  # (name, milliseconds)
+        self.enabled = enabled
+        self.reported = False
+        self.first_frame = None  # Time the first frame was shown
+
+    def mark(self, name, now=None):
+        # Everything since the previous mark belongs to this phase
+        now = time.perf_counter() if now is None else now
+        self.phases.append((name, (now - self.last) * 1000))
+        self.last = now
+
+    def frame_shown(self):
+        self.mark('first frame')
+        self.first_frame = self.last
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self.last = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.mark(name)
+
+    def report(self):
+        # Printed once, when the first frame is on screen
+        if not self.enabled or self.reported:
+            return
+        self.reported = True
+        print("Startup trace:")
+        for name, ms in self.phases:
+            print(f"  {name:28} {ms:8.1f} ms")
+        if self.first_frame is not None:
+            print(f"  {'time to first frame':28} {(self.first_frame - self.started) * 1000:8.1f} ms (since the first import)")
+
+
+startup_trace = StartupTrace(startup_started, os.environ.get("NORDEUS_TRACE_STARTUP", "") not in ("", "0"))
+startup_trace.mark('import pygame', pygame_imported)
+startup_trace.mark('import stdlib and numpy', modules_imported)
+
+
+#Class which will be used to time the phases of every frame
+#Each phase keeps a rolling window for the percentiles shown in the overlay, whole runs can be recorded and exported
+class FrameProfiler:
+    def __init__(self, window=PROFILE_WINDOW):
+        self.window = window
+        self.history = {}  # Phase name: deque of the last milliseconds measured
+        self.frame = {}  # Phases measured so far in the current frame
+        self.frames = None  # Every finished frame, only kept while recording
+        self.overlay_visible = False
+        self.overlay = None
+        self.overlay_age = 0
+
+    def start_recording(self):
+        self.frames = []
+
+    @contextlib.contextmanager
+    def section(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - started) * 1000)
+
+    def add(self, name, milliseconds):
+        if threading.current_thread() is not threading.main_thread():
+            return  # Work done by background threads is not part of any frame
+        self.frame[name] = self.frame.get(name, 0) + milliseconds
+
+    def end_frame(self):
+        for name, milliseconds in self.frame.items():
+            if name not in self.history:
+                self.history[name] = collections.deque(maxlen=self.window)
+            self.history[name].append(milliseconds)
+        if self.frames is not None:
+            self.frames.append(self.frame)
+        self.frame = {}
+
+    def summary(self, samples=None):
+        # Count, mean, percentiles and max per phase, of the rolling window or of the given samples
+        samples = samples if samples is not None else self.history
+        result = {}
+        for name, values in sorted(samples.items()):
+            values = np.fromiter(values, dtype=float)
+            percentiles = np.percentile(values, PROFILE_PERCENTILES)
+            result[name] = {"count": int(values.size), "mean": float(values.mean()), "max": float(values.max())}
+            result[name].update({f"p{p}": float(value) for p, value in zip(PROFILE_PERCENTILES, percentiles)})
+        return result
+
+    def export(self, path):
+        # JSON gets every frame and a summary of the run, CSV gets one row per frame
+        frames = self.frames or []
+        names = sorted({name for frame in frames for name in frame})
+        if path.endswith('.csv'):
+            with open(path, 'w', newline='') as export_file:
+                writer = csv.writer(export_file)
+                writer.writerow(['frame'] + names)
+                for index, frame in enumerate(frames):
+                    writer.writerow([index] + [f"{frame[name]:.4f}" if name in frame else '' for name in names])
+        else:
+            samples = {name: [frame[name] for frame in frames if name in frame] for name in names}
+            with open(path, 'w') as export_file:
+                json.dump({"frames": frames, "summary": self.summary(samples)}, export_file, indent=1)
+
+    def toggle_overlay(self):
+        self.overlay_visible = not self.overlay_visible
+        self.overlay = None
+
+    def get_overlay(self, font):
+        # Surface with the percentile table, None when hidden, the text is only rendered again every few frames
+        if not self.overlay_visible:
+            return None
+        self.overlay_age += 1
+        if self.overlay is None or self.overlay_age >= OVERLAY_REFRESH:
+            self.overlay_age = 0
+            header = "phase".ljust(16) + "".join(f"p{p}".rjust(8) for p in PROFILE_PERCENTILES)
+            lines = [header] + [name.ljust(16) + "".join(f"{stats[f'p{p}']:8.2f}" for p in PROFILE_PERCENTILES)
+                                for name, stats in self.summary().items()]
+            line_height = font.get_linesize()
+            width = max(font.size(line)[0] for line in lines) + 10
+            self.overlay = pygame.Surface((width, line_height * len(lines) + 10), pygame.SRCALPHA)
+            self.overlay.fill((0, 0, 0, 170))
+            for index, line in enumerate(lines):
+                self.overlay.blit(font.render(line, True, WHITE), (5, 5 + index * line_height))
+        return self.overlay
+
+
+profiler = FrameProfiler()
+
+
+#Class which will be used to decode the sound effects once and play them on reserved mixer channels
+class SoundBank:
+    def __init__(self):
+        self.sounds = {}
+        self.channels = {}
+        self.timings = {}  # Milliseconds spent on each load and on the last play call of each effect
+
+    def load(self, sound_dir, effects=SOUND_EFFECTS):
+        # Reserved channels are never picked by Sound.play, so feedback is never cut off by other sounds
+        pygame.mixer.set_reserved(len(effects))
+        for channel_id, (name, (file_name, volume)) in enumerate(effects.items()):
+            started = time.perf_counter()
+            sound = pygame.mixer.Sound(os.path.join(sound_dir, file_name))  # Decodes the whole file into memory
+            sound.set_volume(volume)
+            self.timings[f"load {name}"] = (time.perf_counter() - started) * 1000
+            self.sounds[name] = sound
+            self.channels[name] = pygame.mixer.Channel(channel_id)
+
+    def play(self, name):
+        # Does nothing when the bank was never loaded, for example in headless tools
+        if name not in self.sounds:
+            return
+        started = time.perf_counter()
+        self.channels[name].play(self.sounds[name])
+        self.timings[f"play {name}"] = (time.perf_counter() - started) * 1000
+
+
+sound_bank = SoundBank()
+
+
+#Class which will be used to play the music tracks
+#The files are read into memory by a background thread, so switching tracks never touches the disk on the main thread
+class MusicPlayer:
+    def __init__(self, tracks, volume):
+        self.tracks = tracks
+        self.volume = volume
+        self.current = random.randint(0, len(tracks) - 1)  # Randomly select a music track
+        self.track_data = {}
+        self.stream = None  # The mixer keeps reading from this while the track plays
+        self.timings = {}  # Milliseconds spent reading each file and on the last track switch
+        self.thread = threading.Thread(target=self._read_tracks, name="MusicPlayer", daemon=True)
+
+    def start(self):
+        self.play(self.current)
+        self.thread.start()
+
+    def _read_tracks(self):
+        for index, path in enumerate(self.tracks):
+            started = time.perf_counter()
+            with open(path, 'rb') as track_file:
+                self.track_data[index] = track_file.read()
+            self.timings[f"read {os.path.basename(path)}"] = (time.perf_counter() - started) * 1000
+
+    def play(self, index):
+        started = time.perf_counter()
+        self.current = index
+        data = self.track_data.get(index)
+        if data is not None:
+            self.stream = io.BytesIO(data)
+            pygame.mixer.music.load(self.stream, os.path.splitext(self.tracks[index])[1][1:])
+        else:
+            pygame.mixer.music.load(self.tracks[index])  # Not read yet, only happens for the very first track
+        pygame.mixer.music.play(-1, 0.0)  # Loop music indefinitely
+        pygame.mixer.music.set_volume(self.volume)
+        self.timings["switch"] = (time.perf_counter() - started) * 1000
+
+    def set_volume(self, volume):
+        # Kept so the next track starts at the same volume
+        self.volume = volume
+        pygame.mixer.music.set_volume(volume)
+
+    def next_track(self):
+        self.play((self.current + 1) % len(self.tracks))
+
+
 #Class which will be used to create the cells of the grid
+#A cell is only a view into the height array of its map, so cells are created on demand
 class Cell:
-    def __init__(self, x, y, height, water_sprite, land_sprite):
+    __slots__ = ("map", "x", "y")
+
+    def __init__(self, grid_map, x, y):
+        self.map = grid_map
         self.x = x
         self.y = y
-        self.height = height
-        self.is_land = height > 0
-        self.visited = False
-        self.water_sprite = water_sprite
-        self.land_sprite = land_sprite
-        self.darken_cache = {}
 
-    def get_darker_sprite(self, factor):
-        if factor not in self.darken_cache:
-            darkened_sprite = self.darken_sprite(self.land_sprite if self.is_land else self.water_sprite, factor)
-            self.darken_cache[factor] = darkened_sprite
-        return self.darken_cache[factor]
+    @property
+    def height(self):
+        return int(self.map.heights[self.x, self.y])
 
-    def darken_sprite(self, sprite, factor):
-        darkened_sprite = sprite.copy()
-        darkened_sprite.lock()  # Lock the surface for pixel access
-        width, height = darkened_sprite.get_size()
-
-        for x in range(width):
-            for y in range(height):
-                color = darkened_sprite.get_at((x, y))
-                r, g, b, a = color
-                # Darken the color by the factor, ensuring the values remain within valid range
-                r = max(0, int(r * factor))
-                g = max(0, int(g * factor))
-                b = max(0, int(b * factor))
-                darkened_sprite.set_at((x, y), (r, g, b, a))
-
-        darkened_sprite.unlock()  # Unlock the surface
-        return darkened_sprite
+    @height.setter
+    def height(self, value):
+        self.map.set_height(self.x, self.y, value)  # Keeps the islands and the drawn terrain up to date
+
+    @property
+    def is_land(self):
+        return bool(self.map.heights[self.x, self.y] > 0)
+
+    @property
+    def water_sprite(self):
+        return self.map.water_sprite
+
+    @property
+    def land_sprite(self):
+        return self.map.land_sprite
+
+    def __eq__(self, other):
+        return isinstance(other, Cell) and self.map is other.map and self.x == other.x and self.y == other.y
+
+    def __hash__(self):
+        return hash((id(self.map), self.x, self.y))
+
+    def get_darker_sprite(self, factor):
+        return sprite_atlas.get(self.land_sprite if self.is_land else self.water_sprite, factor)
 
     def render(self, screen):
-        darkening_factor = max(0.5, 1 - self.height * 0.05)  # Adjust the factor for desired effect
-        sprite = self.land_sprite if self.is_land else self.water_sprite
-        darkened_sprite = self.get_darker_sprite(darkening_factor)
+        darkened_sprite = self.get_darker_sprite(darkening_factor(self.height))
         screen.blit(darkened_sprite, (self.x * CELL_SIZE, self.y * CELL_SIZE))
 
 #Class which will be used to create the islands
+#An island is a view of one label of its map, the cells are looked up from the label array
 class Island:
-    def __init__(self, cells):
-        self.cells = cells
+    def __init__(self, grid_map, label):
+        self.map = grid_map
+        self.label = label
+        self._cells = None
+
+    @property
+    def cells(self):
+        if self._cells is None:
+            size_y = self.map.heights.shape[1]
+            self._cells = [Cell(self.map, int(index) // size_y, int(index) % size_y) for index in self.map.island_members(self.label)]
+        return self._cells
+
+    @property
+    def size(self):
+        return int(self.map.island_sizes[self.label])
 
     def average_height(self):
-        total_height = sum(cell.height for cell in self.cells)
-        return total_height / len(self.cells) if self.cells else 0
+        return float(self.map.island_averages[self.label])
 
-    def render(self, screen, highlight=False):
-        color = GREEN if highlight else LIGHT_BROWN
-        for cell in self.cells:
-            pygame.draw.rect(screen, color, (cell.x * CELL_SIZE, cell.y * CELL_SIZE, CELL_SIZE, CELL_SIZE))
+    def coordinates(self):
+        # x and y arrays of all cells of the island
+        return np.divmod(self.map.island_members(self.label), self.map.heights.shape[1])
 
-#Class which will be used to create the grid map of the game
-class GridMap:
-    def __init__(self, size=GRID_SIZE, difficulty='easy', water_sprite=None, land_sprite=None, predefined_matrix=None):
-        self.size = size
-        self.difficulty = difficulty
-        self.grid = []
+    def bounds(self):
+        # Rectangle around all cells of the island, in cells
+        xs, ys = self.coordinates()
+        return pygame.Rect(int(xs.min()), int(ys.min()), int(xs.max()) - int(xs.min()) + 1, int(ys.max()) - int(ys.min()) + 1)
 
-        if predefined_matrix:
-            # Use the predefined matrix to set up grid
-                self.grid = [[Cell(x, y, predefined_matrix[x][y], water_sprite, land_sprite) for y in range(size)] for x in range(size)]
-                self.islands = []
-                self.find_islands()
-        else:
-            # Otherwise, generate grid with random land heights
-            self.grid = [[Cell(x, y, 0, water_sprite, land_sprite) for y in range(size)] for x in range(size)]
-            self.islands = []
-            self._generate_land_with_priority()
-
-    def _generate_land_with_priority(self):
-        # Only used if no predefined matrix is given
-        for x in range(self.size):
-            for y in range(self.size):
-                height = random.choices([0, random.randint(1, 5)], weights=[0.8, 0.2])[0]
-                self.grid[x][y].height = height
-                self.grid[x][y].is_land = height > 0
-
-        self.find_islands()
-
-        # Identify the maximum island(s)
-        max_island = max(self.islands, key=lambda island: len(island.cells), default=None)
-        max_height_islands = [island for island in self.islands if island.average_height() == max_island.average_height()]
-
-        # For 'easy' difficulty, set the max height island's cells to 10
-        if self.difficulty == 'easy' and max_island:
-            for cell in max_island.cells:
-                cell.height = 10
-        else:
-            # In 'hard' mode, make one of the max height islands slightly taller
-            if len(max_height_islands) > 1:
-                island_to_increase = random.choice(max_height_islands)
-                for cell in island_to_increase.cells:
-                    cell.height = random.randint(7, 10)  # Assign a slightly larger height range
-
-            # Set other islands' heights (for non-max islands, randomize a bit)
-            for island in self.islands:
-                if island != max_island:
-                    for cell in island.cells:
-                        if len(island.cells) > 1:
-                            cell.height = min(9, cell.height + random.randint(3, 5))
-                        elif cell.height > 0:
-                            cell.height = min(cell.height, random.randint(1, 7))
+    def __eq__(self, other):
+        return isinstance(other, Island) and self.map is other.map and self.label == other.label
 
-    def find_islands(self):
-        for row in self.grid:
-            for cell in row:
-                cell.visited = False
-
-        for x in range(self.size):
-            for y in range(self.size):
-                cell = self.grid[x][y]
-                if cell.is_land and not cell.visited:
-                    island_cells = self._get_connected_land_cells(cell)
-                    self.islands.append(Island(island_cells))
-
-    def _get_connected_land_cells(self, start_cell):
-        stack = [start_cell]
-        connected_cells = []
-
-        while stack:
-            cell = stack.pop()
-            if cell.visited:
-                continue
-            cell.visited = True
-            connected_cells.append(cell)
+    def __hash__(self):
+        return hash((id(self.map), self.label))
 
-            for neighbor in self._get_neighbors(cell):
-                if neighbor.is_land and not neighbor.visited:
-                    stack.append(neighbor)
+    def render(self, screen, highlight=False, view=None):
+        if view is None:
+            view = MapView(screen.get_size())
+            view.set_map(self.map)
+        overlay = view.island_overlay(self, 'win' if highlight else 'plain')
+        if overlay:
+            screen.blit(*overlay)
 
-        return connected_cells
+#Class which will be used to list the islands of a map without creating all of them up front
+class IslandList:
+    __slots__ = ("map",)
 
-    def _get_neighbors(self, cell):
-        directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]
-        neighbors = []
+    def __init__(self, grid_map):
+        self.map = grid_map
 
-        for dx, dy in directions:
-            nx, ny = cell.x + dx, cell.y + dy
-            if 0 <= nx < self.size and 0 <= ny < self.size:
-                neighbors.append(self.grid[nx][ny])
+    def __len__(self):
+        return self.map.island_count
 
-        return neighbors
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.map.island(label) for label in range(1, len(self) + 1)[index]]
+        return self.map.island(range(1, len(self) + 1)[index])
 
-    def render(self, screen):
-        for row in self.grid:
-            for cell in row:
-                cell.render(screen)
+#Class which will be used to index the cells of a map as grid[x][y] without storing them
+class CellGrid:
+    __slots__ = ("map", "x")
+
+    def __init__(self, grid_map, x=None):
+        self.map = grid_map
+        self.x = x
+
+    def __len__(self):
+        return self.map.heights.shape[0 if self.x is None else 1]
+
+    def __getitem__(self, index):
+        index = range(len(self))[index]  # Same bounds and negative index rules as a list
+        if self.x is None:
+            return CellGrid(self.map, index)
+        return Cell(self.map, self.x, index)
+
+#Class which will be used to create the grid map of the game
+#Heights and island labels are kept in compact 2D arrays, cells and islands are views into them
+class GridMap:
+    def __init__(self, size=GRID_SIZE, difficulty='easy', water_sprite=None, land_sprite=None, predefined_matrix=None, seed=None):
+        self.size = size
+        self.difficulty = difficulty
+        self.seed = None
+        self.water_sprite = water_sprite
+        self.land_sprite = land_sprite
+        self.grid = CellGrid(self)
+        self.islands = IslandList(self)
+        self.terrain_version = 0  # Changes whenever the drawn terrain has to be rendered again
+        self.terrain_edits = collections.deque(maxlen=TERRAIN_EDIT_LOG)  # (version, x, y) of the latest changes, x is None for the whole map
+        self.labels = None
+        self.island_count = 0
+        self._members = None
+        self._bounds = None  # Per label (min x, max x, min y, max y), only kept once the map is edited
+        self._best = None  # Label of the highest island, None when it has to be looked up again
+        self._island_views = {}
+
+        if predefined_matrix is not None:
+            # Use the predefined matrix to set up grid
+            self.heights = np.asarray(predefined_matrix, dtype=HEIGHT_DTYPE)  # Arrays from read_matrix are used as they are
+            if not self.heights.flags.writeable:
+                self.heights = self.heights.copy()  # Edits write into the heights, for example of a map archive view
+            self.size = self.heights.shape[0]
+            self.find_islands()
+        else:
+            # Otherwise, generate grid with random land heights, the seed is kept so the map can be reproduced
+            self.seed = seed if seed is not None else random.randrange(2 ** 32)
+            self.heights = generate_heights(size, difficulty, self.seed)
+            self.find_islands()
+
+    def find_islands(self):
+        # Relabels the whole map, previous Island views are dropped
+        self.labels, self.island_count = label_islands(self.heights)
+        self._members = None
+        self._bounds = None
+        self._best = None
+        self._island_views = {}
+        self.update_island_stats()
+
+    def update_island_stats(self):
+        # Height sum, cell count and average per label, index 0 is the water
+        self.island_sums, self.island_sizes, self.island_averages = island_stats(self.heights, self.labels, self.island_count)
+
+    def island(self, label):
+        if label not in self._island_views:
+            self._island_views[label] = Island(self, label)
+        return self._island_views[label]
+
+    def island_at(self, x, y):
+        # Constant time lookup through the label array, None for water
+        label = int(self.labels[x, y])
+        return self.island(label) if label else None
+
+    def highest_island(self):
+        # First island with the greatest average height, same tie breaking as max()
+        # After edits the labels are no longer in scan order, ties then keep the island that was already the highest
+        if not self.island_count:
+            return None
+        if self._best is None:
+            self._best = int(np.argmax(self.island_averages[1:self.island_count + 1])) + 1
+        return self.island(self._best)
+
+    def island_members(self, label):
+        # Flat indices of the cells of one island, grouped for all islands on first use
+        # Edited maps search the bounding box of the island instead, the grouping would be stale after every edit
+        if self._bounds is not None:
+            x0, x1, y0, y1 = self._bounds[:, label].tolist()
+            xs, ys = np.nonzero(self.labels[x0:x1 + 1, y0:y1 + 1] == label)
+            return (xs + x0) * self.heights.shape[1] + ys + y0
+        if self._members is None:
+            flat_labels = self.labels.ravel()
+            land = np.flatnonzero(flat_labels)
+            order = land[np.argsort(flat_labels[land], kind='stable')]
+            bounds = np.cumsum(np.bincount(flat_labels, minlength=self.island_count + 1))
+            self._members = (order, bounds)
+        order, bounds = self._members
+        return order[bounds[label - 1] - bounds[0]:bounds[label] - bounds[0]]
+
+    def set_height(self, x, y, height):
+        # Changes one cell and updates only the islands around it, the rest of the map is not relabeled
+        if not 0 <= height <= MAX_HEIGHT:
+            raise ValueError(f"height {height} at ({x}, {y}) is outside 0..{MAX_HEIGHT}")
+        old = int(self.heights[x, y])
+        if height == old:
+            return
+        if self._bounds is None:
+            self._track_islands()
+        self.heights[x, y] = height
+        label = int(self.labels[x, y])
+
+        if old and height:
+            # Same island, only its height sum changes
+            self._add_to_island(label, height - old, 0)
+        elif height:
+            self._add_land(x, y, height)
+        else:
+            self._remove_land(x, y, label, old)
+        self.invalidate_terrain(x, y)
+
+    def _track_islands(self):
+        # Bounding boxes of all islands, and room in the stats arrays for islands created by edits
+        flat_labels = self.labels.ravel()
+        land = np.flatnonzero(flat_labels)
+        xs, ys = np.divmod(land, self.heights.shape[1])
+        labels = flat_labels[land]
+        capacity = max(16, 2 * (self.island_count + 1))
+        self._bounds = np.zeros((4, capacity), dtype=np.int64)
+        self._bounds[(0, 2), :] = np.iinfo(np.int64).max
+        np.minimum.at(self._bounds[0], labels, xs)
+        np.maximum.at(self._bounds[1], labels, xs)
+        np.minimum.at(self._bounds[2], labels, ys)
+        np.maximum.at(self._bounds[3], labels, ys)
+        self._resize_stats(capacity)
+        self._members = None
+
+    def _resize_stats(self, capacity):
+        used = self.island_count + 1
+        for name in ('island_sums', 'island_sizes', 'island_averages'):
+            array = getattr(self, name)
+            resized = np.zeros(capacity, dtype=array.dtype)
+            resized[:used] = array[:used]
+            setattr(self, name, resized)
+        if self._bounds.shape[1] < capacity:
+            bounds = np.zeros((4, capacity), dtype=np.int64)
+            bounds[:, :used] = self._bounds[:, :used]
+            self._bounds = bounds
+
+    def _new_label(self):
+        if self.island_count + 1 >= len(self.island_sizes):
+            self._resize_stats(2 * len(self.island_sizes))
+        self.island_count += 1
+        label = self.island_count
+        self.island_sums[label] = self.island_sizes[label] = self.island_averages[label] = 0
+        self._island_views.pop(label, None)
+        return label
+
+    def _add_to_island(self, label, height, size):
+        # Adds height and size to the totals of one island, then checks whether the highest island changed
+        best_average = self.island_averages[self._best] if self._best is not None else None
+        self.island_sums[label] += height
+        self.island_sizes[label] += size
+        self.island_averages[label] = self.island_sums[label] / max(1, self.island_sizes[label])
+        if self._best is None:
+            return
+        if label == self._best:
+            if self.island_averages[label] < best_average:
+                self._best = None  # It got lower, another island may be higher now
+        elif self.island_averages[label] > best_average:
+            self._best = label
+
+    def _neighbour_labels(self, x, y):
+        size_x, size_y = self.heights.shape
+        labels = set()
+        for nx, ny in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+            if 0 <= nx < size_x and 0 <= ny < size_y and self.labels[nx, ny]:
+                labels.add(int(self.labels[nx, ny]))
+        return labels
+
+    def _add_land(self, x, y, height):
+        neighbours = self._neighbour_labels(x, y)
+        if not neighbours:
+            label = self._new_label()
+            self._bounds[:, label] = (x, x, y, y)
+        else:
+            # The new cell joins its neighbours into one island, the biggest keeps its label so fewer cells change
+            label = max(neighbours, key=lambda neighbour: self.island_sizes[neighbour])
+            for other in sorted(neighbours - {label}, reverse=True):
+                x0, x1, y0, y1 = self._bounds[:, other].tolist()
+                block = self.labels[x0:x1 + 1, y0:y1 + 1]
+                block[block == other] = label
+                self._bounds[:, label] = (min(self._bounds[0, label], x0), max(self._bounds[1, label], x1),
+                                          min(self._bounds[2, label], y0), max(self._bounds[3, label], y1))
+                self._add_to_island(label, self.island_sums[other], self.island_sizes[other])
+                label = self._drop_label(other, label)
+            self._bounds[:, label] = (min(self._bounds[0, label], x), max(self._bounds[1, label], x),
+                                      min(self._bounds[2, label], y), max(self._bounds[3, label], y))
+        self.labels[x, y] = label
+        self._island_views.pop(label, None)
+        self._add_to_island(label, height, 1)
+
+    def _remove_land(self, x, y, label, height):
+        self.labels[x, y] = 0
+        self._island_views.pop(label, None)
+        self._add_to_island(label, -height, -1)
+        if not self.island_sizes[label]:
+            self._drop_label(label)
+        elif self._splits(x, y, label):
+            parts = self._cut_off_parts(x, y, label)
+            if parts is None:
+                self._split_island(label)  # Too big to search cell by cell, costs as much as labeling the island's bounding box
+            for cells in parts or ():
+                self._move_part(label, cells)
+
+    def _splits(self, x, y, label):
+        # Walks the 8 cells around (x, y), if its land neighbours are all joined along that ring the island stays whole
+        size_x, size_y = self.heights.shape
+        ring = [0 <= x + dx < size_x and 0 <= y + dy < size_y and self.labels[x + dx, y + dy] == label
+                for dx, dy in ((-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1))]
+        groups = 0
+        for index in range(0, 8, 2):  # Even positions are the direct neighbours
+            # A direct neighbour starts a new group unless the ring is land from the previous direct neighbour
+            if ring[index] and not (ring[index - 1] and ring[index - 2]):
+                groups += 1
+        return groups > 1
+
+    def _cut_off_parts(self, x, y, label):
+        # Flood fills from the land neighbours of (x, y) in turns, one cell each, fills that meet are joined
+        # A fill that runs out of cells while others are still going found a part that was cut off, the last fill keeps the label
+        # Returns the flat cells of every cut off part, or None when the fills visited SPLIT_SEARCH_CELLS cells first
+        size_x, size_y = self.heights.shape
+        labels = self.labels.ravel()
+        fills = []
+        for nx, ny in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+            if 0 <= nx < size_x and 0 <= ny < size_y and self.labels[nx, ny] == label:
+                cell = nx * size_y + ny
+                fills.append((collections.deque([cell]), [cell]))  # Cells to expand, cells found
+        owner = {cells[0]: index for index, (_, cells) in enumerate(fills)}
+        joined = list(range(len(fills)))  # Fill every fill was joined into
+        active = set(joined)
+        parts = []
+        visited = len(fills)
+        while len(active) > 1:
+            for index in list(active):
+                if index not in active:
+                    continue
+                pending, cells = fills[index]
+                if not pending:
+                    active.discard(index)
+                    parts.append(cells)
+                    if len(active) == 1:
+                        break
+                    continue
+                cell = pending.popleft()
+                cell_x, cell_y = divmod(cell, size_y)
+                for neighbour, inside in ((cell - size_y, cell_x > 0), (cell + size_y, cell_x < size_x - 1),
+                                          (cell - 1, cell_y > 0), (cell + 1, cell_y < size_y - 1)):
+                    if not inside or labels[neighbour] != label:
+                        continue
+                    other = owner.get(neighbour)
+                    if other is None:
+                        owner[neighbour] = index
+                        pending.append(neighbour)
+                        cells.append(neighbour)
+                        visited += 1
+                        continue
+                    while joined[other] != other:
+                        other = joined[other]
+                    if other != index:
+                        # The fills met, so their cells are one part, the other fill goes on as this one
+                        joined[other] = index
+                        pending.extend(fills[other][0])
+                        cells.extend(fills[other][1])
+                        active.discard(other)
+                if visited > SPLIT_SEARCH_CELLS:
+                    return None
+        return parts
+
+    def _move_part(self, label, cells):
+        # Gives the cut off cells of an island a new label, the bounds of the rest stay as they were and may be loose
+        xs, ys = np.divmod(np.array(cells), self.heights.shape[1])
+        part_label = self._new_label()
+        self.labels[xs, ys] = part_label
+        height = int(self.heights[xs, ys].sum(dtype=np.int64))
+        self._bounds[:, part_label] = (xs.min(), xs.max(), ys.min(), ys.max())
+        self._best = None
+        self._add_to_island(label, -height, -len(cells))
+        self._add_to_island(part_label, height, len(cells))
+        self._island_views.pop(label, None)
+
+    def _split_island(self, label):
+        # Relabels the bounding box of one island, every extra part becomes a new island
+        x0, x1, y0, y1 = self._bounds[:, label].tolist()
+        block = self.labels[x0:x1 + 1, y0:y1 + 1]
+        parts, count = label_islands(block == label)
+        if count < 2:
+            return
+        sums = np.bincount(parts.ravel(), weights=self.heights[x0:x1 + 1, y0:y1 + 1].ravel(), minlength=count + 1).astype(np.int64)
+        sizes = np.bincount(parts.ravel(), minlength=count + 1)
+        self._best = None
+        for part in range(1, count + 1):
+            part_label = label if part == 1 else self._new_label()
+            cells = parts == part
+            block[cells] = part_label
+            xs, ys = np.nonzero(cells)
+            self._bounds[:, part_label] = (x0 + xs.min(), x0 + xs.max(), y0 + ys.min(), y0 + ys.max())
+            self.island_sums[part_label], self.island_sizes[part_label] = sums[part], sizes[part]
+            self.island_averages[part_label] = sums[part] / sizes[part]
+            self._island_views.pop(part_label, None)
+
+    def _drop_label(self, label, kept=None):
+        # Frees the label of a vanished island by moving the last label into it, so labels stay 1..island_count
+        # Returns the label that kept has now, it changes when kept was the last label
+        last = self.island_count
+        if label != last:
+            x0, x1, y0, y1 = self._bounds[:, last].tolist()
+            block = self.labels[x0:x1 + 1, y0:y1 + 1]
+            block[block == last] = label
+            self._bounds[:, label] = self._bounds[:, last]
+            for array in (self.island_sums, self.island_sizes, self.island_averages):
+                array[label] = array[last]
+        self.island_count -= 1
+        self._island_views.pop(label, None)
+        self._island_views.pop(last, None)
+        if self._best == label:
+            self._best = None
+        elif self._best == last:
+            self._best = label
+        return label if kept == last else kept
+
+    def invalidate_terrain(self, x=None, y=None):
+        # Call after changing heights so the next frame draws the terrain again
+        # With a cell only the chunks around it are rendered again, otherwise the whole terrain is
+        self.terrain_version += 1
+        self.terrain_edits.append((self.terrain_version, x, y))
+
+
+#Class which will be used to map between screen pixels and map cells, with pan and zoom
+#x and y are the map pixel shown in the top-left corner of the screen at the current cell size
+class Camera:
+    def __init__(self, size=(WINDOW_SIZE, WINDOW_SIZE), cell_size=CELL_SIZE):
+        self.width, self.height = size
+        self.cell_size = cell_size
+        self.x = 0
+        self.y = 0
+        self.map_cells = (GRID_SIZE, GRID_SIZE)
+
+    def set_map_size(self, map_cells):
+        self.map_cells = map_cells
+        self.clamp()
+
+    def clamp(self):
+        # The map never scrolls past its edges, smaller maps stay in the top-left corner
+        self.x = min(max(0, self.x), max(0, self.map_cells[0] * self.cell_size - self.width))
+        self.y = min(max(0, self.y), max(0, self.map_cells[1] * self.cell_size - self.height))
+
+    def pan(self, dx, dy):
+        self.x += int(dx)
+        self.y += int(dy)
+        self.clamp()
+
+    def zoom(self, steps, pos):
+        # Moves through ZOOM_CELL_SIZES and keeps the map point under pos in place
+        levels = list(ZOOM_CELL_SIZES)
+        current = min(range(len(levels)), key=lambda index: abs(levels[index] - self.cell_size))
+        cell_size = levels[min(max(0, current + steps), len(levels) - 1)]
+        if cell_size == self.cell_size:
+            return
+        anchor_x = (self.x + pos[0]) / self.cell_size
+        anchor_y = (self.y + pos[1]) / self.cell_size
+        self.cell_size = cell_size
+        self.x = int(anchor_x * cell_size - pos[0])
+        self.y = int(anchor_y * cell_size - pos[1])
+        self.clamp()
+
+    def screen_to_cell(self, pos):
+        # (x, y) of the cell under a screen position, None outside the map
+        x = (self.x + pos[0]) // self.cell_size
+        y = (self.y + pos[1]) // self.cell_size
+        if 0 <= x < self.map_cells[0] and 0 <= y < self.map_cells[1]:
+            return x, y
+        return None
+
+    def cell_to_screen(self, x, y):
+        return x * self.cell_size - self.x, y * self.cell_size - self.y
+
+    def cell_rect_to_screen(self, rect):
+        x, y = self.cell_to_screen(rect.x, rect.y)
+        return pygame.Rect(x, y, rect.width * self.cell_size, rect.height * self.cell_size)
+
+    def visible_cells(self):
+        # (left, top, right, bottom) cell range on screen, right and bottom are exclusive
+        return (self.x // self.cell_size, self.y // self.cell_size,
+                min(self.map_cells[0], (self.x + self.width) // self.cell_size + 1),
+                min(self.map_cells[1], (self.y + self.height) // self.cell_size + 1))
+
+    def state(self):
+        return self.x, self.y, self.cell_size
+
+
+#Class which will be used to draw a map through a camera
+#The map is split into chunks that are rendered once per cell size and kept in an LRU cache with a memory cap,
+#only the chunks on screen are drawn, so any map size costs about the same as the window
+class MapView:
+    def __init__(self, size=(WINDOW_SIZE, WINDOW_SIZE), cache_bytes=CHUNK_CACHE_BYTES):
+        self.camera = Camera(size)
+        self.cache_bytes = cache_bytes
+        self.chunks = collections.OrderedDict()  # (chunk x, chunk y, cell size): surface, oldest first
+        self.cached_bytes = 0
+        self.map = None
+        self.terrain_version = None
+        self.background = None
+        self.background_key = None
+        self.overlays = collections.OrderedDict()  # (label, style, camera state, terrain version): (surface, position) or None
+        self.scene = None  # Background with island overlays drawn on it
+        self.scene_key = None
+
+    def set_map(self, grid_map):
+        if grid_map is not self.map:
+            self.map = grid_map
+            self.camera.set_map_size(grid_map.heights.shape)
+            self.clear()
+
+    def clear(self):
+        self.chunks.clear()
+        self.overlays.clear()
+        self.cached_bytes = 0
+        self.terrain_version = self.map.terrain_version if self.map else None
+        self.background_key = None
+
+    def adopt(self, other):
+        # Takes over the map and chunks another view rendered, and its background when both cameras show the same area
+        self.set_map(other.map)
+        self.chunks = other.chunks
+        self.cached_bytes = other.cached_bytes
+        self.terrain_version = other.terrain_version
+        if other.camera.state() == self.camera.state():
+            self.background = other.background
+            self.background_key = other.background_key
+
+    def chunk_cells(self, cell_size=None):
+        # Cells per chunk side, chunks are about CHUNK_PIXELS wide at every zoom level
+        return max(1, CHUNK_PIXELS // (cell_size or self.camera.cell_size))
+
+    def refresh(self):
+        # Catches up with terrain changes, edited cells only drop the chunks they are in
+        edits = [edit for edit in self.map.terrain_edits if edit[0] > self.terrain_version]
+        if len(edits) != self.map.terrain_version - self.terrain_version or any(x is None for _, x, _ in edits):
+            self.clear()
+            return
+        for cell_size in {key[2] for key in self.chunks}:
+            cells = self.chunk_cells(cell_size)
+            for _, x, y in edits:
+                chunk = self.chunks.pop((x // cells, y // cells, cell_size), None)
+                if chunk is not None:
+                    self.cached_bytes -= chunk.get_width() * chunk.get_height() * chunk.get_bytesize()
+        self.terrain_version = self.map.terrain_version
+        self.background_key = None
+
+    def get_chunk(self, chunk_x, chunk_y):
+        key = (chunk_x, chunk_y, self.camera.cell_size)
+        chunk = self.chunks.get(key)
+        if chunk is not None:
+            self.chunks.move_to_end(key)
+            return chunk
+
+        with profiler.section('render.chunks'):
+            cells = self.chunk_cells()
+            cell_size = self.camera.cell_size
+            block = self.map.heights[chunk_x * cells:(chunk_x + 1) * cells, chunk_y * cells:(chunk_y + 1) * cells]
+            # Tile 0 is water, tile 1 + level is land darkened for that height level
+            tiles = sprite_atlas.get_tiles(self.map.water_sprite, self.map.land_sprite, cell_size)
+            levels = np.where(block > 0, 1 + np.minimum(block, len(DARKEN_FACTORS) - 1), 0)
+            width, height = levels.shape
+            pixels = tiles[levels].transpose(0, 2, 1, 3, 4).reshape(width * cell_size, height * cell_size, 3)
+            chunk = pygame.Surface((width * cell_size, height * cell_size))
+            pygame.surfarray.blit_array(chunk, pixels)
+
+        self.chunks[key] = chunk
+        self.cached_bytes += chunk.get_width() * chunk.get_height() * chunk.get_bytesize()
+        while self.cached_bytes > self.cache_bytes and len(self.chunks) > 1:
+            _, evicted = self.chunks.popitem(last=False)
+            self.cached_bytes -= evicted.get_width() * evicted.get_height() * evicted.get_bytesize()
+        return chunk
+
+    def island_overlay(self, island, style):
+        # (surface, screen position) of a filled and outlined island for the current camera, None when it is off screen
+        # The surface covers only the visible part of the island and is cached until the camera or terrain changes
+        key = (island.label, style, self.camera.state(), self.map.terrain_version)
+        if key in self.overlays:
+            self.overlays.move_to_end(key)
+            return self.overlays[key]
+
+        with profiler.section('render.islands'):
+            overlay = self.draw_island_overlay(island, style)
+        self.overlays[key] = overlay
+        if len(self.overlays) > ISLAND_OVERLAY_CACHE:
+            self.overlays.popitem(last=False)
+        return overlay
+
+    def draw_island_overlay(self, island, style):
+        camera = self.camera
+        cell_size = camera.cell_size
+        bounds = island.bounds()
+        left, top, right, bottom = camera.visible_cells()
+        x0, x1 = max(bounds.left, left), min(bounds.right, right)
+        y0, y1 = max(bounds.top, top), min(bounds.bottom, bottom)
+        if x0 >= x1 or y0 >= y1:
+            return None
+
+        # Cells around the visible part are included, so the outline is right at the screen edges
+        margin = -(-OUTLINE_WIDTH // cell_size)
+        mx0, my0 = max(0, x0 - margin), max(0, y0 - margin)
+        cells = self.map.labels[mx0:x1 + margin, my0:y1 + margin] == island.label
+        pixels = np.pad(np.repeat(np.repeat(cells, cell_size, axis=0), cell_size, axis=1), 1)
+        inner = pixels.copy()
+        for _ in range(OUTLINE_WIDTH):
+            eroded = inner.copy()
+            eroded[1:, :] &= inner[:-1, :]
+            eroded[:-1, :] &= inner[1:, :]
+            eroded[:, 1:] &= inner[:, :-1]
+            eroded[:, :-1] &= inner[:, 1:]
+            inner = eroded
+        crop = (slice(1 + (x0 - mx0) * cell_size, 1 + (x1 - mx0) * cell_size), slice(1 + (y0 - my0) * cell_size, 1 + (y1 - my0) * cell_size))
+        fill, outline = pixels[crop], pixels[crop] & ~inner[crop]
+
+        fill_color, outline_color = ISLAND_STYLES[style]
+        surface = pygame.Surface(fill.shape, pygame.SRCALPHA)
+        colors = pygame.surfarray.pixels3d(surface)
+        colors[fill] = fill_color[:3]
+        colors[outline] = outline_color[:3]
+        del colors
+        alpha = pygame.surfarray.pixels_alpha(surface)
+        alpha[fill] = fill_color[3]
+        alpha[outline] = outline_color[3]
+        del alpha
+        return surface, camera.cell_to_screen(x0, y0)
+
+    def get_scene(self, overlays):
+        # The background with the given island overlays on it, composed once and reused while they stay the same
+        # Frames restore dirty areas from the scene, so translucent overlays are never drawn twice over each other
+        background = self.get_background()
+        if not overlays:
+            return background
+        key = (background, tuple((surface, position) for surface, position in overlays))
+        if key != self.scene_key:
+            self.scene = background.copy()  # A new surface, so the app sees that the frame changed
+            for surface, position in overlays:
+                self.scene.blit(surface, position)
+            self.scene_key = key
+        return self.scene
+
+    def get_background(self):
+        # Window sized surface with the terrain under the camera, a new surface whenever the camera or terrain changes
+        if self.map.terrain_version != self.terrain_version:
+            self.refresh()
+        key = self.camera.state()
+        if key != self.background_key:
+            camera = self.camera
+            background = pygame.Surface((camera.width, camera.height))
+            background.fill(WHITE)
+            chunk_pixels = self.chunk_cells() * camera.cell_size
+            last_x = min(camera.x + camera.width, self.map.heights.shape[0] * camera.cell_size) - 1
+            last_y = min(camera.y + camera.height, self.map.heights.shape[1] * camera.cell_size) - 1
+            for chunk_x in range(camera.x // chunk_pixels, last_x // chunk_pixels + 1):
+                for chunk_y in range(camera.y // chunk_pixels, last_y // chunk_pixels + 1):
+                    background.blit(self.get_chunk(chunk_x, chunk_y), (chunk_x * chunk_pixels - camera.x, chunk_y * chunk_pixels - camera.y))
+            self.background = background
+            self.background_key = key
+        return self.background
 
 
 #Class which will be used to create the game itself
 class Game:
-    def __init__(self, map_size=GRID_SIZE, difficulty='easy', water_sprite=None, land_sprite=None, predefined_matrix=None):
+    def __init__(self, map_size=GRID_SIZE, difficulty='easy', water_sprite=None, land_sprite=None, predefined_matrix=None, seed=None):
         self.predifined_matrix = predefined_matrix
-        self.map = GridMap(map_size, difficulty, water_sprite, land_sprite, predefined_matrix)
-        self.map.find_islands()
-        self.target_island = max(self.map.islands, key=lambda island: island.average_height())
+        self.map = GridMap(map_size, difficulty, water_sprite, land_sprite, predefined_matrix, seed)
+        self.target_island = self.map.highest_island()
         self.attempts = 3
         self.correct_guess = False
         self.message = "Click on an island to guess!"
         self.hover_message = ""
+        self.hover_island = None  # Island under the cursor, outlined while guessing
         self.cheats_enabled = False
         self.game_over_time = None
+        self.dirty_rects = []  # Map areas changed by the game since the last frame, in cells
 
     def guess_island(self, cell):
         if self.attempts == 0 or self.correct_guess:
             return
 
-        guessed_island = next((island for island in self.map.islands if cell in island.cells), None)
+        guessed_island = self.map.island_at(cell.x, cell.y)
 
-        if guessed_island == self.target_island:
+        if guessed_island is not None and guessed_island == self.target_island:
             self.correct_guess = True
             self.message = "Congratulations! You found the highest island! New game in 3 seconds"
 
-            # play sound located in sound folder where script is
-            script_dir = os.path.dirname(__file__)
-
-            sound = pygame.mixer.Sound(os.path.join(script_dir, 'sound', 'correct.ogg'))
-            sound.set_volume(0.3)
-            sound.play()
-
-
+            # play the preloaded sound, no file is read on a click
+            sound_bank.play('correct')
 
-            self.game_over_time = pygame.time.get_ticks()
+            self.game_over_time = game_clock.ticks()
         else:
             self.attempts -= 1
 
-            # play sound located in sound folder where script is
-            script_dir = os.path.dirname(__file__)
-
-            sound = pygame.mixer.Sound(os.path.join(script_dir, 'sound', 'wrong.ogg'))
-            sound.set_volume(0.1)
-            sound.play()
+            # play the preloaded sound, no file is read on a click
+            sound_bank.play('wrong')
 
             self.message = f"Wrong guess! Attempts left: {self.attempts}" if self.attempts > 0 else "Game over! Restarting in 3 seconds."
             if self.attempts == 0:
-                self.game_over_time = pygame.time.get_ticks()
+                self.game_over_time = game_clock.ticks()
+
+        if self.correct_guess:
+            self.dirty_rects.append(self.target_island.bounds())
 
     def update_hover_message(self, cell):
-        if self.cheats_enabled:
-            island = next((island for island in self.map.islands if cell in island.cells), None)
-            self.hover_message = f"Island Average Height: {island.average_height():.2f}" if island else ""
+        island = self.map.island_at(cell.x, cell.y) if cell is not None else None
+        self.hover_island = island
+        if self.cheats_enabled and island:
+            self.hover_message = f"Island Average Height: {island.average_height():.2f}"
         else:
             self.hover_message = ""
 
+    def edit_cell(self, x, y, height):
+        # Changes the height of one cell, the target follows the highest island of the edited map
+        # After a win the found island stays the target, one of its other cells finds it again once labels moved
+        anchor = None
+        if self.correct_guess and self.target_island is not None:
+            xs, ys = self.target_island.coordinates()
+            others = np.flatnonzero((xs != x) | (ys != y))
+            if len(others):
+                anchor = int(xs[others[0]]), int(ys[others[0]])
+        self.map.set_height(x, y, height)
+        self.hover_island = None  # Labels may have moved, the next hover update finds the island again
+        if not self.correct_guess:
+            self.target_island = self.map.highest_island()
+        else:
+            self.target_island = self.map.island_at(*anchor) if anchor else None  # None once its last cell is water
+
     def restart_game(self, difficulty):
         self.__init__(self.map.size, difficulty)
 
-    def render(self, screen, font):
-        self.map.render(screen)
-        if self.correct_guess:
-            self.target_island.render(screen, highlight=True)
+    def render(self, screen, font, view):
+        view.set_map(self.map)
+        screen.blit(view.get_scene(self.island_overlays(view)), (0, 0))
+        self.render_overlays(screen, font)
+
+    def island_overlays(self, view):
+        # (surface, position) of the win highlight and of the outline of the hovered island while guessing
+        overlays = []
+        if self.correct_guess and self.target_island is not None:
+            overlays.append(view.island_overlay(self.target_island, 'win'))
+        elif self.attempts > 0 and self.hover_island is not None:
+            overlays.append(view.island_overlay(self.hover_island, 'hover'))
+        return [overlay for overlay in overlays if overlay]
 
-        message_text = font.render(self.message, True, (0,0,0))
-        screen.blit(message_text, (10, WINDOW_SIZE - 30))
+    def render_overlays(self, screen, font):
+        # Text drawn on top of the map
+        screen.blit(text_cache.render(self.message, font, BLACK), (10, MESSAGE_Y))
 
         if self.hover_message:
-            hover_text = font.render(self.hover_message, True, (0,0,0))
-            screen.blit(hover_text, (10, WINDOW_SIZE - 60))
+            screen.blit(text_cache.render(self.hover_message, font, BLACK), (10, HOVER_MESSAGE_Y))
 
 
 class PauseMenu:
@@ -322,28 +1712,41 @@ class PauseMenu:
         self.max_volume = 0.3  # Maximum volume level
         self.is_cheats_enabled = False  # Initialize cheats as off
         self.is_music_on = True
+        self.panel = None  # The whole menu drawn once, only drawn again when panel_key changes
+        self.panel_key = None
+
+    def buttons(self):
+        # Resume and cheats are only shown once a game exists
+        if self.app.game is not None:
+            return [self.resume_button, self.new_game_button, self.cheats_button, self.music_button, self.exit_button]
+        return [self.new_game_button, self.music_button, self.exit_button]
 
     def render(self):
         if self.is_paused:
-            self.screen.fill((0, 0, 0, 150))  
-            if self.app.game is not None:
-                self.resume_button.render(self.screen)
-            self.new_game_button.render(self.screen)
-            if self.app.game is not None:
-                self.cheats_button.render(self.screen)
-            self.music_button.render(self.screen)
-            self.exit_button.render(self.screen)
-            pygame.draw.rect(self.screen, (200, 200, 200), self.volume_slider_rect)
-            pygame.draw.rect(self.screen, (231, 72, 42), pygame.Rect(
-                self.volume_slider_rect.x,
-                self.volume_slider_rect.y,
-                (self.volume_level - self.min_volume) / (self.max_volume - self.min_volume) * self.volume_slider_rect.width,
-                self.volume_slider_rect.height
-            ))
-            # Display volume percentage text
-            volume_percent = int((self.volume_level - self.min_volume) / (self.max_volume - self.min_volume) * 100)
-            volume_text = self.font.render(f"Volume: {volume_percent}%", True, WHITE)
-            self.screen.blit(volume_text, (self.volume_slider_rect.x + 5, self.volume_slider_rect.y - 25))
+            buttons = self.buttons()
+            key = (tuple(buttons), tuple(button.is_hovered() for button in buttons), self.volume_level)
+            if key != self.panel_key:
+                self.panel = self.draw_panel(buttons)
+                self.panel_key = key
+            self.screen.blit(self.panel, (0, 0))
+
+    def draw_panel(self, buttons):
+        panel = pygame.Surface(self.screen.get_size())
+        panel.fill(BLACK)
+        for button in buttons:
+            button.render(panel)
+        pygame.draw.rect(panel, (200, 200, 200), self.volume_slider_rect)
+        pygame.draw.rect(panel, (231, 72, 42), pygame.Rect(
+            self.volume_slider_rect.x,
+            self.volume_slider_rect.y,
+            (self.volume_level - self.min_volume) / (self.max_volume - self.min_volume) * self.volume_slider_rect.width,
+            self.volume_slider_rect.height
+        ))
+        # Display volume percentage text
+        volume_percent = int((self.volume_level - self.min_volume) / (self.max_volume - self.min_volume) * 100)
+        volume_text = text_cache.render(f"Volume: {volume_percent}%", self.font, WHITE)
+        panel.blit(volume_text, (self.volume_slider_rect.x + 5, self.volume_slider_rect.y - 25))
+        return panel
 
     def handle_events(self, event):
         if event.type == pygame.MOUSEBUTTONDOWN:
@@ -359,13 +1762,12 @@ class PauseMenu:
             elif self.music_button.is_clicked(event):
                 self.toggle_music()
             elif self.exit_button.is_clicked(event):
-                pygame.quit()
-                quit()
-        elif event.type == pygame.MOUSEMOTION and pygame.mouse.get_pressed()[0]:
+                self.app.running = False
+        elif event.type == pygame.MOUSEMOTION and event.buttons[0]:
             if event.pos[0] in range(self.volume_slider_rect.x, self.volume_slider_rect.x + self.volume_slider_rect.width) and \
                event.pos[1] in range(self.volume_slider_rect.y, self.volume_slider_rect.y + self.volume_slider_rect.height):
                 self.volume_level = self.min_volume + (event.pos[0] - self.volume_slider_rect.x) / self.volume_slider_rect.width * (self.max_volume - self.min_volume)
-                pygame.mixer.music.set_volume(self.volume_level)
+                self.app.music.set_volume(self.volume_level)
 
     def start_new_game(self):
         # Show difficulty options when starting a new game
@@ -391,9 +1793,10 @@ class PauseMenu:
             hard_button.render(self.screen)
             nordeus_button.render(self.screen)
             pygame.display.flip()
-            for event in pygame.event.get():
+            self.app.scheduler.tick(animating=False)  # Nothing moves here, sleep until the player does something
+            for event in self.app.poll_events():
                 if event.type == pygame.QUIT:
-                    pygame.quit()
+                    self.app.running = False
                     return None
                 elif easy_button.is_clicked(event):
                     return 'easy'
@@ -403,26 +1806,181 @@ class PauseMenu:
                     return 'nordeus'
 
     def toggle_music(self):
-        self.app.current_music = (self.app.current_music + 1) % len(self.app.music_tracks)
-        pygame.mixer.music.load(self.app.music_tracks[self.app.current_music])
-        pygame.mixer.music.play(-1, 0.0)
+        self.app.music.next_track()
+
+#Class which will be used to keep a few Nordeus maps downloaded and parsed ahead of time
+#A daemon thread fills the queue through one pooled session, the game only takes ready maps out of it
+class MapPrefetcher:
+    def __init__(self, url=NORDEUS_MAP_URL, size=PREFETCH_SIZE, timeout=FETCH_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+        self.maps = queue.Queue(maxsize=size)
+        self.session = None  # Created by the download thread, so importing requests never stalls a frame
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="MapPrefetcher", daemon=True)
+        self.last_error = None
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.session is not None:
+            self.session.close()
+
+    def pop(self):
+        # Never blocks, returns None when no map is ready yet
+        try:
+            return self.maps.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _run(self):
+        import requests
+        self.session = requests.Session()
+        self.session.mount(self.url, requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        failures = 0
+        while not self.stop_event.is_set():
+            try:
+                matrix = GameApp.fetch_matrix(self.url, self.session, self.timeout)
+            except Exception as e:
+                # Network errors, bad maps and anything unexpected are retried, the thread only ends with stop
+                self.last_error = e
+                failures += 1
+                self.stop_event.wait(min(FETCH_BACKOFF_MAX, FETCH_BACKOFF * 2 ** (failures - 1)))
+                continue
+
+            failures = 0
+            self.last_error = None
+            while not self.stop_event.is_set():
+                try:
+                    self.maps.put(matrix, timeout=0.5)
+                    break
+                except queue.Full:
+                    pass
+        self.session.close()
+
+#Class which will be used to build the next game while the last one shows its result
+#The map, its islands and the terrain under the camera are made by a thread, GameApp swaps the game in when the restart delay ends
+class GameBuilder:
+    def __init__(self):
+        self.after = None  # Game the current build follows, so every game starts one build at most
+        self.build = None  # Dict of the current build, its thread fills in the result
+
+    def start(self, after, difficulty, seed, matrix, water_sprite, land_sprite, camera):
+        # The seed is picked by the caller, so the game is the same one a build on the main thread would make
+        self.after = after
+        self.build = {'difficulty': difficulty, 'seed': seed, 'result': None}
+        self.build['thread'] = threading.Thread(target=self._run, args=(self.build, difficulty, seed, matrix, water_sprite, land_sprite,
+                                                (camera.width, camera.height), camera.state()), name="GameBuilder", daemon=True)
+        self.build['thread'].start()
+
+    def take(self, difficulty, seed=None):
+        # The built game and its view when they were made for this difficulty and seed, None otherwise
+        # A build that is still running is waited for, it is already part of the way through
+        build, self.build = self.build, None
+        if build is None or build['difficulty'] != difficulty or (seed is not None and build['seed'] != seed):
+            return None  # A build of another game is dropped, its thread finishes on its own
+        build['thread'].join()
+        return build['result']
+
+    @staticmethod
+    def _run(build, difficulty, seed, matrix, water_sprite, land_sprite, view_size, camera_state):
+        try:
+            game = Game(difficulty=difficulty, water_sprite=water_sprite, land_sprite=land_sprite, predefined_matrix=matrix, seed=seed)
+            view = MapView(view_size)
+            view.camera.x, view.camera.y, view.camera.cell_size = camera_state
+            view.set_map(game.map)
+            view.get_background()
+            if game.map.island_count:
+                game.map.island_members(1)  # Groups the cells of all islands, the first hover or win highlight needs them
+        except Exception as e:
+            # The game is built again on the main thread, where the same error is raised
+            print(f"An error occurred while building the next game: {e}")
+            return
+        build['result'] = (game, view)
+
+#Class which will be used to pace every loop of the game
+#While something animates frames run at ACTIVE_FPS, otherwise the loop sleeps in pygame.event.wait until input or a timer wakes it
+class FrameScheduler:
+    def __init__(self, clock=None, fps=ACTIVE_FPS, idle_wake=IDLE_WAKE_MS):
+        self.clock = clock or pygame.time.Clock()
+        self.fps = fps
+        self.idle_wake = idle_wake
+        self.idle = False
+        self.paced = True  # Replays turn pacing off and run frames as fast as possible
+        self.wake_event = None  # Event that ended the last idle sleep, handed out first by events
+
+    def events(self):
+        # Events of the next frame in the order they happened
+        events = pygame.event.get()
+        if self.wake_event is not None:
+            events.insert(0, self.wake_event)
+            self.wake_event = None
+        return events
+
+    def tick(self, animating, wake=None):
+        # wake is the longest idle sleep in milliseconds, for loops that poll something
+        self.idle = not animating
+        if not self.paced:
+            return
+        if animating:
+            self.clock.tick(self.fps)
+            return
+        if self.wake_event is None:
+            # Returns at once with the oldest event when some are queued
+            event = pygame.event.wait(min(self.idle_wake, wake) if wake is not None else self.idle_wake)
+            if event.type != pygame.NOEVENT:
+                self.wake_event = event  # Posting it back would put it behind events that came in later
+        self.clock.tick()  # Keeps get_fps and the next active frame time right
+
 
 #Class which will be used to create the game app
 class GameApp:
-    def __init__(self):
-        pygame.init()
-        pygame.mixer.init()
-        self.screen = pygame.display.set_mode((WINDOW_SIZE, WINDOW_SIZE))
-        pygame.display.set_caption("Island Guessing Game")
+    def __init__(self, profile_out=None, record_path=None):
+        with startup_trace.phase('pygame.init'):
+            pygame.init()
+            pygame.mixer.init()
+        with startup_trace.phase('window'):
+            self.screen = pygame.display.set_mode((WINDOW_SIZE, WINDOW_SIZE))
+            pygame.display.set_caption("Island Guessing Game")
         self.clock = pygame.time.Clock()
-        self.font = pygame.font.Font(None, FONT_SIZE)
+        self.scheduler = FrameScheduler(self.clock)
+        with startup_trace.phase('fonts'):
+            self.font = fonts.get(FONT_SIZE)
         self.running = True
-        self.load_sprites()
-        self.pause_menu = PauseMenu(self.screen, self.font, self)
-        self.pause_menu.is_paused = True  # Show pause menu on startup
-        self.load_music()
+        with startup_trace.phase('terrain sprites'):
+            self.load_sprites()
+        self._clouds = None  # Loaded when a game is first drawn, the menus have no clouds
+        with startup_trace.phase('pause menu'):
+            self.pause_menu = PauseMenu(self.screen, self.font, self)
+            self.pause_menu.is_paused = True  # Show pause menu on startup
+        # Sounds and music are loaded by finish_startup once the first frame is on screen
+        self.music = MusicPlayer([os.path.join(os.path.dirname(__file__), 'music', file_name) for file_name in MUSIC_FILES], self.pause_menu.volume_level)
+        self.started = False
         self.game = None  # Initialize game to None so resume and cheats are hidden initially
-
+        self.map_url = NORDEUS_MAP_URL
+        self.map_prefetcher = None  # Started the first time a Nordeus game is requested
+        self.waiting_for_map_since = None
+        self.view = MapView()  # Camera and chunk cache the maps are drawn through
+        self.game_builder = GameBuilder()  # Builds the next game during the restart delay
+        self.rendered_background = None  # Background currently on screen, a different one means a full redraw
+        self.previous_cloud_rects = []
+        self.previous_overlay_rects = []
+        self.profile_out = profile_out  # File the frame timings are exported to when the game closes
+        if profile_out:
+            profiler.start_recording()
+        self.frame = 0
+        self.mouse_pos = pygame.mouse.get_pos()  # Last position seen in the events, so replays do not need a real mouse
+        self.held_keys = set()  # Pan keys held down
+        self.event_source = None  # Replaces pygame's event queue, see replay.py
+        self.pending_seeds = collections.deque()  # Seeds for the next generated maps, replays set them
+        self.recorder = None
+        if record_path:
+            self.recorder = SessionRecorder(record_path)
+            self.recorder.start(self)
+
+        startup_trace.mark('other GameApp setup')
         print("GameApp initialized successfully.")
 
  
@@ -431,16 +1989,21 @@ class GameApp:
     def load_music(self):
         script_dir = os.path.dirname(__file__)
 
-        # Load music tracks
-        self.music_tracks = [
-            os.path.join(script_dir, 'music', 'track1.ogg'),
-            os.path.join(script_dir, 'music', 'track2.ogg'),
-            os.path.join(script_dir, 'music', 'track3.ogg')
-        ]
-        self.current_music = random.randint(0, len(self.music_tracks) - 1)  # Randomly select a music track
-        pygame.mixer.music.load(self.music_tracks[self.current_music])
-        pygame.mixer.music.play(-1, 0.0)  # Loop music indefinitely
-        pygame.mixer.music.set_volume(self.pause_menu.volume_level)
+        # Decode the sound effects once, clicks only play them
+        with startup_trace.phase('sound effects'):
+            sound_bank.load(os.path.join(script_dir, 'sound'))
+        print("Sounds loaded: " + ", ".join(f"{name} {ms:.1f} ms" for name, ms in sound_bank.timings.items()))
+
+        # Start the first track, the others are read by the player's thread
+        with startup_trace.phase('music'):
+            self.music.start()
+
+    def finish_startup(self):
+        # Work the first frame does not need, done right after it is shown
+        startup_trace.frame_shown()
+        self.started = True
+        self.load_music()
+        startup_trace.report()
 
 
 
@@ -456,141 +2019,325 @@ class GameApp:
             self.water_sprite = pygame.transform.scale(self.water_sprite, (CELL_SIZE, CELL_SIZE))
             self.land_sprite = pygame.transform.scale(self.land_sprite, (CELL_SIZE, CELL_SIZE))
 
-            # Load three different cloud textures
-            cloud_texture_1 = pygame.image.load(os.path.join(script_dir, 'texture', 'Cloud1.png')).convert_alpha()
-            cloud_texture_2 = pygame.image.load(os.path.join(script_dir, 'texture', 'Cloud2.png')).convert_alpha()
-            cloud_texture_3 = pygame.image.load(os.path.join(script_dir, 'texture', 'Cloud3.png')).convert_alpha()
-
-            # Resize clouds to fit the game (optional)
-            cloud_width = 64
-            cloud_height = 32
-            cloud_texture_1 = pygame.transform.scale(cloud_texture_1, (cloud_width, cloud_height))
-            cloud_texture_2 = pygame.transform.scale(cloud_texture_2, (cloud_width, cloud_height))
-            cloud_texture_3 = pygame.transform.scale(cloud_texture_3, (cloud_width, cloud_height))
-
-            # Store the cloud textures
-            self.cloud_images = [cloud_texture_1, cloud_texture_2, cloud_texture_3]
-
-            # Create cloud shadows with the same shape as the clouds
-            self.cloud_shadows = []
-            for cloud in self.cloud_images:
-                # Create a shadow by darkening the cloud
-                shadow = cloud.copy()
-                shadow.fill((0, 0, 0, 100), special_flags=pygame.BLEND_RGBA_MULT)  # Darken the cloud with transparency
-                self.cloud_shadows.append(shadow)
-
-            # Create clouds with random speeds and positions
-            self.clouds = []  # Clear previous clouds before recreating
-            for i in range(3):  # Create 3 clouds
-                # Randomly flip the cloud image to make it look different
-                cloud_image = self.cloud_images[i]
-                if random.choice([True, False]):
-                    cloud_image = pygame.transform.flip(cloud_image, True, False)  # Randomly flip horizontally
-
-                # Get the corresponding shadow for this cloud
-                cloud_shadow = self.cloud_shadows[i]
-
-                cloud = Cloud(
-                    cloud_image,  # Use transformed cloud image
-                    random.randint(0, WINDOW_SIZE),
-                    random.randint(20, 500),
-                    random.randint(1, 2),  # Random speed for the cloud
-                    cloud_shadow  # Set cloud shadow
-                )
-                self.clouds.append(cloud)
+            # Darken every height level of both sprites up front, all cells share them
+            sprite_atlas.build([self.water_sprite, self.land_sprite])
 
             print("Sprites loaded successfully.")
         except pygame.error as e:
             print(f"Error loading images: {e}")
             pygame.quit()
     
+    @property
+    def clouds(self):
+        # Cloud textures are only loaded when a game is first drawn
+        if self._clouds is None:
+            self.load_clouds()
+        return self._clouds
+
+    def load_clouds(self):
+        script_dir = os.path.dirname(__file__)
+        with startup_trace.phase('clouds'):
+            try:
+                # Load three different cloud textures
+                cloud_texture_1 = pygame.image.load(os.path.join(script_dir, 'texture', 'Cloud1.png')).convert_alpha()
+                cloud_texture_2 = pygame.image.load(os.path.join(script_dir, 'texture', 'Cloud2.png')).convert_alpha()
+                cloud_texture_3 = pygame.image.load(os.path.join(script_dir, 'texture', 'Cloud3.png')).convert_alpha()
+
+                # Resize clouds to fit the game (optional)
+                cloud_texture_1 = pygame.transform.scale(cloud_texture_1, CLOUD_SIZE)
+                cloud_texture_2 = pygame.transform.scale(cloud_texture_2, CLOUD_SIZE)
+                cloud_texture_3 = pygame.transform.scale(cloud_texture_3, CLOUD_SIZE)
+
+                # Store the cloud textures
+                self.cloud_images = [cloud_texture_1, cloud_texture_2, cloud_texture_3]
+
+                # Create cloud shadows with the same shape as the clouds
+                self.cloud_shadows = []
+                for cloud in self.cloud_images:
+                    # Create a shadow by darkening the cloud
+                    shadow = cloud.copy()
+                    shadow.fill((0, 0, 0, 100), special_flags=pygame.BLEND_RGBA_MULT)  # Darken the cloud with transparency
+                    self.cloud_shadows.append(shadow)
+
+                # Create clouds with random speeds and positions, all of them move and draw together
+                self._clouds = SpriteLayer(shadow_offset=CLOUD_SHADOW_OFFSET)
+                for i in range(CLOUD_COUNT):
+                    # Randomly flip the cloud image to make it look different, the flipped copy is shared
+                    texture = i % len(self.cloud_images)
+                    variant = self._clouds.variant(self.cloud_images[texture], self.cloud_shadows[texture], flip_x=random.choice([True, False]))
+                    self._clouds.add(variant, random.randint(0, WINDOW_SIZE), random.randint(20, 500), random.randint(1, 2))  # Random speed for the cloud
+            except pygame.error as e:
+                print(f"Error loading cloud images: {e}")
+                self._clouds = SpriteLayer()
+
     @staticmethod
-    def fetch_matrix(url):
-        # Send GET request to retrieve the matrix text
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an error if the request was unsuccessful
+    def fetch_matrix(url, session=None, timeout=FETCH_TIMEOUT):
+        if session is None:
+            import requests
+            session = requests
+        # Send GET request to retrieve the matrix text, the body is parsed as it arrives
+        with session.get(url, timeout=timeout, stream=True) as response:
+            response.raise_for_status()  # Raise an error if the request was unsuccessful
 
-        # Split the response text into rows and convert it to a 2D list of integers
-        matrix = [list(map(int, row.split())) for row in response.text.strip().splitlines()]
-
-        # Ensure the matrix is 30x30
-        if len(matrix) == 30 and all(len(row) == 30 for row in matrix):
-            return matrix
-        else:
-            raise ValueError("The matrix is not 30x30.")       
+            # Any rectangular map is accepted, up to the size the camera is built for
+            return read_matrix(response.iter_content(PARSE_CHUNK_BYTES), max_cells=FETCH_MAX_CELLS)
 
 
 
     def start_game(self, difficulty):
         self.difficulty = difficulty
-        if difficulty == 'nordeus':
-            try:
-                matrix = self.fetch_matrix("https://jobfair.nordeus.com/jf24-fullstack-challenge/test")
-                self.game = Game(difficulty=difficulty, water_sprite=self.water_sprite, land_sprite=self.land_sprite, predefined_matrix=matrix)
-                self.pause_menu.is_paused = False  
-            except Exception as e:
-                print(f"An error occurred: {e}")
-                self.game = Game(difficulty='easy', water_sprite=self.water_sprite, land_sprite=self.land_sprite)
-                self.pause_menu.is_paused = False  
-            
+        self.waiting_for_map_since = None
+        if self.swap_next_game(difficulty):
+            self.pause_menu.is_paused = False  # The game built after the last one was for this difficulty
+        elif difficulty == 'nordeus':
+            self.wait_for_nordeus_map()
+            self.pause_menu.is_paused = False
         else:
-            self.game = Game(difficulty=self.difficulty, water_sprite=self.water_sprite, land_sprite=self.land_sprite)
+            self.new_game(self.difficulty)
             self.pause_menu.is_paused = False 
+
+    def wait_for_nordeus_map(self):
+        # The map is taken from the prefetch queue by update, so the frame loop never waits on the network
+        if self.map_prefetcher is None:
+            self.map_prefetcher = MapPrefetcher(self.map_url)
+            self.map_prefetcher.start()
+        self.waiting_for_map_since = game_clock.ticks()
+        if self.game:
+            self.game.message = "Loading the next Nordeus map..."
+        self.poll_nordeus_map()
+
+    def poll_nordeus_map(self):
+        matrix = self.map_prefetcher.pop()
+        if matrix is not None:
+            self.new_game('nordeus', matrix)
+            self.waiting_for_map_since = None
+        elif game_clock.ticks() - self.waiting_for_map_since > MAP_WAIT_LIMIT:
+            print(f"An error occurred: {self.map_prefetcher.last_error or 'no Nordeus map arrived in time'}")
+            self.new_game('easy')
+            self.waiting_for_map_since = None
+
+    def new_game(self, difficulty, matrix=None):
+        # Every game of the app is created here, so recordings know the seed or map of each one
+        seed = self.pending_seeds.popleft() if self.pending_seeds and matrix is None else None
+        self.game = Game(difficulty=difficulty, water_sprite=self.water_sprite, land_sprite=self.land_sprite, predefined_matrix=matrix, seed=seed)
+        if self.recorder:
+            self.recorder.record_game(self.game, matrix)
+
+    def prepare_next_game(self):
+        # Starts building the next game as soon as this one is over, swap_next_game takes it when the restart delay ends
+        matrix = seed = None
+        if self.difficulty == 'nordeus':
+            matrix = self.map_prefetcher.pop() if self.map_prefetcher else None
+            if matrix is None:
+                return  # Tried again next frame, without a map the restart waits for one like before
+        else:
+            # The seed new_game would use, a replay that queues another one later gets its game built again
+            seed = self.pending_seeds[0] if self.pending_seeds else random.randrange(2 ** 32)
+        self.game_builder.start(self.game, self.difficulty, seed, matrix, self.water_sprite, self.land_sprite, self.view.camera)
+
+    def swap_next_game(self, difficulty):
+        # Swaps in the game built during the restart delay, False when there is none for this difficulty
+        seed = self.pending_seeds[0] if self.pending_seeds and difficulty != 'nordeus' else None
+        built = self.game_builder.take(difficulty, seed)
+        if built is None:
+            return False
+        if seed is not None:
+            self.pending_seeds.popleft()
+        self.game, view = built
+        self.view.adopt(view)  # The first frame draws chunks that are already rendered
+        if self.recorder:
+            self.recorder.record_game(self.game, self.game.predifined_matrix)
+        return True
     
     def run(self):
         while self.running:
-            self.handle_events()
-            self.update()
-            self.render()
-            self.clock.tick(30)
+            with profiler.section('events'):
+                self.handle_events()
+            with profiler.section('update'):
+                self.update()
+            with profiler.section('render'):
+                self.render()
+            if not self.started:
+                self.finish_startup()
+            with profiler.section('tick'):
+                self.scheduler.tick(self.is_animating(), self.idle_wake())
+            profiler.end_frame()
+
+        if self.profile_out:
+            profiler.export(self.profile_out)
+            print(f"Frame timings written to {self.profile_out}")
+
+        if self.map_prefetcher:
+            self.map_prefetcher.stop()
+
+        if self.recorder:
+            self.recorder.close()
+
+    def is_animating(self):
+        # Clouds move whenever a game is on screen, the menus and the loading screen are still
+        return self.game is not None and not self.pause_menu.is_paused
+
+    def idle_wake(self):
+        # A Nordeus map download is polled more often than the idle default
+        return MAP_POLL_MS if self.waiting_for_map_since is not None else None
+
+    def poll_events(self):
+        # Events of one frame, every call starts a frame of the recording and freezes the game clock for it
+        if self.event_source is not None:
+            self.frame, now, events = self.event_source.next_frame()
+        else:
+            self.frame, now, events = self.frame + 1, pygame.time.get_ticks(), self.scheduler.events()
+        game_clock.set(now)
+        for event in events:
+            if hasattr(event, 'pos'):
+                self.mouse_pos = event.pos
+            if event.type == pygame.KEYDOWN and event.key in PAN_KEYS:
+                self.held_keys.add(event.key)
+            elif event.type == pygame.KEYUP:
+                self.held_keys.discard(event.key)
+        if self.recorder:
+            self.recorder.next_frame(self.frame, now, keep=bool(self.held_keys))
+            self.recorder.record_events(events)
+        return events
 
     def handle_events(self):
-        for event in pygame.event.get():
+        for event in self.poll_events():
             if event.type == pygame.QUIT:
                 self.running = False
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                profiler.toggle_overlay()
             elif event.type == pygame.KEYDOWN and event.key == pygame.K_p:
                 self.pause_menu.is_paused = not self.pause_menu.is_paused
             elif self.pause_menu.is_paused:
                 self.pause_menu.handle_events(event)
             elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
-                pygame.quit()  
+                self.running = False
+            elif event.type == pygame.MOUSEWHEEL:
+                self.view.camera.zoom(event.y, self.mouse_pos)
+            elif event.type == pygame.MOUSEMOTION and event.buttons[2]:
+                # Dragging with the right button pans the map
+                self.view.camera.pan(-event.rel[0], -event.rel[1])
             else:
-                if event.type == pygame.MOUSEBUTTONDOWN and self.game.attempts > 0:
-                    mouse_x, mouse_y = pygame.mouse.get_pos()
-                    cell_x, cell_y = mouse_x // CELL_SIZE, mouse_y // CELL_SIZE
-                    cell = self.game.map.grid[cell_x][cell_y]
-                    self.game.guess_island(cell)
+                if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1 and self.game and self.game.attempts > 0:
+                    position = self.view.camera.screen_to_cell(event.pos)
+                    if position is not None:
+                        cell = self.game.map.grid[position[0]][position[1]]
+                        with profiler.section('events.guess'):
+                            self.game.guess_island(cell)
+                        if self.recorder:
+                            self.recorder.record_guess(cell, self.game)
 
     def update(self):
+        if self.waiting_for_map_since is not None:
+            with profiler.section('update.network'):
+                self.poll_nordeus_map()
+
         if self.game:
-            if self.game.game_over_time and pygame.time.get_ticks() - self.game.game_over_time > RESTART_DELAY:
-                if self.difficulty == 'nordeus':
-                    matrix = self.fetch_matrix("https://jobfair.nordeus.com/jf24-fullstack-challenge/test")
-                    self.game = Game(difficulty=self.difficulty, water_sprite=self.water_sprite, land_sprite=self.land_sprite, predefined_matrix=matrix)
-                else:
-                    self.game = Game(difficulty=self.difficulty, water_sprite=self.water_sprite, land_sprite=self.land_sprite)  # Restart game after delay
+            if self.game.game_over_time and self.game_builder.after is not self.game and self.waiting_for_map_since is None:
+                with profiler.section('update.prepare'):
+                    self.prepare_next_game()
+            if self.game.game_over_time and game_clock.ticks() - self.game.game_over_time > RESTART_DELAY and self.waiting_for_map_since is None:
+                with profiler.section('update.restart'):
+                    if self.swap_next_game(self.difficulty):
+                        pass  # Built while the result was shown
+                    elif self.difficulty == 'nordeus':
+                        self.wait_for_nordeus_map()
+                    else:
+                        self.new_game(self.difficulty)  # Restart game after delay
 
             # Update cloud positions
-            for cloud in self.clouds:
-                cloud.update()  # Ensure clouds are moving
+            with profiler.section('update.clouds'):
+                self.clouds.update()  # Ensure clouds are moving
+
+            # Arrow keys and WASD pan the map while held
+            dx = sum({PAN_KEYS[key][0] for key in self.held_keys})  # Opposite keys cancel out, duplicates count once
+            dy = sum({PAN_KEYS[key][1] for key in self.held_keys})
+            if dx or dy:
+                self.view.camera.pan(dx * PAN_SPEED, dy * PAN_SPEED)
 
-            mouse_x, mouse_y = pygame.mouse.get_pos()
-            cell_x, cell_y = mouse_x // CELL_SIZE, mouse_y // CELL_SIZE
-            cell = self.game.map.grid[cell_x][cell_y]
-            self.game.update_hover_message(cell)
+            with profiler.section('update.hover'):
+                self.view.set_map(self.game.map)
+                position = self.view.camera.screen_to_cell(self.mouse_pos)
+                cell = self.game.map.grid[position[0]][position[1]] if position is not None else None
+                self.game.update_hover_message(cell)
 
     def render(self):
-        self.screen.fill(WHITE)
+        overlay = profiler.get_overlay(self.font)
+        overlay_rects = [overlay.get_rect()] if overlay else []
+
         if self.pause_menu.is_paused:
+            self.screen.fill(WHITE)
             self.pause_menu.render()
-        else:
-            self.game.render(self.screen, self.font)
-            for cloud in self.clouds:
-                cloud.render(self.screen)
+            if overlay:
+                self.screen.blit(overlay, (0, 0))
+            with profiler.section('render.present'):
+                pygame.display.flip()
+            self.rendered_background = None  # The menu covered the game, redraw all of it when resumed
+            return
 
-        pygame.display.flip()
+        if self.game is None:
+            # First Nordeus map is still downloading
+            self.screen.fill(WHITE)
+            self.screen.blit(text_cache.render("Loading Nordeus map...", self.font, BLACK), (10, MESSAGE_Y))
+            pygame.display.flip()
+            return
+
+        self.view.set_map(self.game.map)
+        with profiler.section('render.map'):
+            background = self.view.get_scene(self.game.island_overlays(self.view))
+        cloud_rects = self.clouds.rects()
+
+        if background is not self.rendered_background:
+            # New game, changed map, moved camera or another island highlighted, draw the whole frame once
+            with profiler.section('render.map'):
+                self.screen.blit(background, (0, 0))
+            with profiler.section('render.text'):
+                self.game.render_overlays(self.screen, self.font)
+            with profiler.section('render.clouds'):
+                self.clouds.render(self.screen)
+            if overlay:
+                self.screen.blit(overlay, (0, 0))
+            with profiler.section('render.present'):
+                pygame.display.flip()
+            self.rendered_background = background
+        else:
+            # Only restore the terrain where something moved or changed, then draw the moving layers on top
+            # Text and the profiler overlay are translucent, so their areas are always restored before drawing them again
+            dirty_rects = self.previous_cloud_rects + cloud_rects + [pygame.Rect(strip) for strip in TEXT_STRIPS]
+            dirty_rects += [self.view.camera.cell_rect_to_screen(rect) for rect in self.game.dirty_rects]
+            dirty_rects += self.previous_overlay_rects + overlay_rects
+            screen_rect = self.screen.get_rect()
+            dirty_rects = [rect.clip(screen_rect) for rect in dirty_rects]  # Blitting with an area needs on-screen rects
+            with profiler.section('render.map'):
+                self.screen.blits([(background, rect, rect) for rect in dirty_rects], doreturn=False)
+            with profiler.section('render.text'):
+                self.game.render_overlays(self.screen, self.font)
+            with profiler.section('render.clouds'):
+                self.clouds.render(self.screen)
+            if overlay:
+                self.screen.blit(overlay, (0, 0))
+            with profiler.section('render.present'):
+                pygame.display.update(dirty_rects)
+
+        self.game.dirty_rects = []
+        self.previous_cloud_rects = cloud_rects
+        self.previous_overlay_rects = overlay_rects
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Island Guessing Game")
+    parser.add_argument("--profile-out", metavar="PATH", help="export the frame timings of the run to a .json or .csv file on exit")
+    parser.add_argument("--record", metavar="PATH", help="record the session for replay.py")
+    parser.add_argument("--trace-startup", action="store_true", help="print the time every startup phase took once the first frame is shown")
+    args = parser.parse_args(argv)
+    if args.trace_startup:
+        startup_trace.enabled = True
+
+    app = GameApp(profile_out=args.profile_out, record_path=args.record)
+    app.run()
+
+
+startup_trace.mark('module')
 
 
 if __name__ == "__main__":
-    app = GameApp()
-    app.run()
\ No newline at end of file
+    main()
@@ -0,0 +1,245 @@
+#
+# Headless record/replay harness for nordeus.py.
+#
+# Record a session with: python nordeus.py --record session.jsonl
+# Replay it with:        python replay.py [--render] [--repeat N] [--profile-out PATH] session.jsonl [...]
+# Load run:              python replay.py --simulate 1000 [--games 5] [--difficulty hard] [--save-dir DIR]
+#
+# Replays skip the frame clock and the RESTART_DELAY waits, feed the recorded events to GameApp and check that
+# every game (seed or map, target, average) and every guess comes out the same as in the recording.
+# --simulate records bot sessions that click through the menus and guess, then replays and checks them.
+#
+
+import argparse
+import collections
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+import nordeus
+
+FRAME_MS = 1000 // nordeus.ACTIVE_FPS  # Game time a simulated frame takes
+TARGET_GUESS_CHANCE = 0.3  # How often the bot clicks the right island
+
+
+#Function which will be used to read a recording, returns the header and the frame records
+def load_recording(path):
+    with open(path) as recording:
+        lines = [json.loads(line) for line in recording if line.strip()]
+    if not lines or lines[0].get("version") != nordeus.RECORDING_VERSION:
+        raise ValueError(f"{path}: not a version {nordeus.RECORDING_VERSION} recording")
+    return lines[0], lines[1:]
+
+
+#Class which will be used in place of MapPrefetcher, it hands out the Nordeus maps of a recording
+class RecordedMaps:
+    def __init__(self):
+        self.maps = collections.deque()
+        self.last_error = None
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def push(self, matrix):
+        self.maps.append(matrix)
+
+    def pop(self):
+        return self.maps.popleft() if self.maps else None
+
+
+#Class which will be used as the event source of a replayed session
+#Every frame gets its recorded time and events, the seeds and maps of the games started in it are queued up front
+class ReplaySource:
+    def __init__(self, app, frames):
+        self.app = app
+        self.frames = iter(frames)
+        self.frame = 0
+        self.time = 0
+
+    def next_frame(self):
+        record = next(self.frames, None)
+        if record is None:
+            # End of the recording, stop the app wherever it is
+            return self.frame + 1, self.time, [pygame.event.Event(pygame.QUIT)]
+        self.frame, self.time = record["frame"], record["time"]
+        for game in record["games"]:
+            if game["matrix"] is not None:
+                self.app.map_prefetcher.push(game["matrix"])
+            else:
+                self.app.pending_seeds.append(game["seed"])
+        return self.frame, self.time, [nordeus.decode_event(event_type, fields) for event_type, fields in record["events"]]
+
+
+#Class which will be used as the event source of a simulated player
+#It clicks New Game and a difficulty, then guesses random islands, and skips the restart delay after every game
+class BotSource:
+    def __init__(self, app, rng, games, difficulty):
+        self.app = app
+        self.rng = rng
+        self.games = games
+        self.difficulty = difficulty
+        self.frame = 0
+        self.time = 0
+        self.started = []
+        self.chose_difficulty = False
+
+    def click(self, pos):
+        return [pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=pos, button=1),
+                pygame.event.Event(pygame.MOUSEBUTTONUP, pos=pos, button=1)]
+
+    def next_frame(self):
+        self.frame += 1
+        self.time += FRAME_MS
+        return self.frame, self.time, self.events()
+
+    def events(self):
+        app, game = self.app, self.app.game
+        if game is None:
+            if not self.chose_difficulty and app.pause_menu.is_paused:
+                # First the New Game button, the next frame is the difficulty selection loop
+                self.chose_difficulty = True
+                return self.click(app.pause_menu.new_game_button.rect.center)
+            column = 1 if self.difficulty == 'easy' else 3
+            return self.click((column * nordeus.WINDOW_SIZE // 4, nordeus.WINDOW_SIZE // 2 + nordeus.BUTTON_HEIGHT // 2))
+
+        if game not in self.started:
+            self.started.append(game)
+        if game.game_over_time is not None:
+            if len(self.started) >= self.games:
+                return [pygame.event.Event(pygame.QUIT)]
+            self.time = max(self.time, game.game_over_time + nordeus.RESTART_DELAY + 1)
+            return []
+
+        if game.target_island and self.rng.random() < TARGET_GUESS_CHANCE:
+            cell = self.rng.choice(game.target_island.cells)
+        else:
+            cell = game.map.grid[self.rng.randrange(game.map.size)][self.rng.randrange(game.map.size)]
+        x, y = app.view.camera.cell_to_screen(cell.x, cell.y)
+        half = app.view.camera.cell_size // 2
+        return self.click((x + half, y + half))
+
+
+#Function which will be used to create a headless app that runs frames as fast as possible
+def create_app(mouse=(0, 0)):
+    with contextlib.redirect_stdout(io.StringIO()):
+        app = nordeus.GameApp()
+    app.scheduler.paced = False
+    app.map_prefetcher = RecordedMaps()
+    app.recorder = nordeus.SessionRecorder()
+    app.recorder.start(app)
+    app.mouse_pos = tuple(mouse)
+    return app
+
+
+#Function which will be used to run an app until its event source quits, returns the number of frames
+def run_frames(app, render=False):
+    frames = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        while app.running:
+            with nordeus.profiler.section('events'):
+                app.handle_events()
+            with nordeus.profiler.section('update'):
+                app.update()
+            if render:
+                with nordeus.profiler.section('render'):
+                    app.render()
+            nordeus.profiler.end_frame()
+            frames += 1
+    app.recorder.close()
+    return frames
+
+
+#Function which will be used to record one bot session in memory, returns the records like load_recording
+def simulate_session(seed, games, difficulty):
+    app = create_app()
+    app.event_source = BotSource(app, random.Random(seed), games, difficulty)
+    app.pending_seeds.extend(random.Random(seed).randrange(2 ** 32) for _ in range(games))
+    run_frames(app)
+    return app.recorder.records[0], app.recorder.records[1:]
+
+
+#Function which will be used to replay one session, returns the replayed frames, games, guesses and the mismatches
+def replay_session(header, frames, render=False):
+    app = create_app(header.get("mouse", (0, 0)))
+    app.event_source = ReplaySource(app, frames)
+    played = run_frames(app, render)
+    replayed = app.recorder.records[1:]
+
+    mismatches = []
+    expected = [(frame["frame"], kind, index, outcome) for frame in frames for kind in ("games", "guesses") for index, outcome in enumerate(frame[kind])]
+    actual = [(frame["frame"], kind, index, outcome) for frame in replayed for kind in ("games", "guesses") for index, outcome in enumerate(frame[kind])]
+    for want, got in zip(expected, actual):
+        if want != got:
+            mismatches.append(f"frame {want[0]}: recorded {want[1]} {want[3]}, replayed {got[1]} {got[3]} at frame {got[0]}")
+    if len(expected) != len(actual):
+        mismatches.append(f"recorded {len(expected)} games and guesses, replayed {len(actual)}")
+    games = sum(len(frame["games"]) for frame in replayed)
+    guesses = sum(len(frame["guesses"]) for frame in replayed)
+    return {"frames": played, "games": games, "guesses": guesses, "mismatches": mismatches}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded nordeus.py sessions headless and check their outcomes.")
+    parser.add_argument("recordings", nargs="*", help="files written by nordeus.py --record")
+    parser.add_argument("--simulate", type=int, metavar="SESSIONS", help="record this many bot sessions and replay them")
+    parser.add_argument("--games", type=int, default=5, help="games per simulated session")
+    parser.add_argument("--difficulty", choices=["easy", "hard"], default="hard", help="difficulty of simulated sessions")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first simulated session")
+    parser.add_argument("--save-dir", help="write the simulated sessions to this directory")
+    parser.add_argument("--repeat", type=int, default=1, help="replay every session this many times")
+    parser.add_argument("--render", action="store_true", help="also render every frame")
+    parser.add_argument("--profile-out", metavar="PATH", help="export the frame timings of the replays to a .json or .csv file")
+    args = parser.parse_args(argv)
+    if not args.recordings and not args.simulate:
+        parser.error("give recordings or --simulate")
+
+    sessions = [(path,) + load_recording(path) for path in args.recordings]
+    if args.simulate:
+        started = time.perf_counter()
+        for index in range(args.simulate):
+            header, frames = simulate_session(args.seed + index, args.games, args.difficulty)
+            name = f"session-{args.seed + index}.jsonl"
+            if args.save_dir:
+                os.makedirs(args.save_dir, exist_ok=True)
+                with open(os.path.join(args.save_dir, name), "w") as out_file:
+                    out_file.writelines(json.dumps(record, separators=(",", ":")) + "\n" for record in [header] + frames)
+            sessions.append((name, header, frames))
+        elapsed = time.perf_counter() - started
+        print(f"Simulated {args.simulate} sessions in {elapsed:.2f}s, {args.simulate / elapsed:.1f} sessions per second.", file=sys.stderr)
+
+    if args.profile_out:
+        nordeus.profiler.start_recording()
+    totals = collections.Counter()
+    failed = 0
+    started = time.perf_counter()
+    for name, header, frames in sessions:
+        for _ in range(args.repeat):
+            result = replay_session(header, frames, args.render)
+            totals.update(sessions=1, frames=result["frames"], games=result["games"], guesses=result["guesses"])
+            if result["mismatches"]:
+                failed += 1
+                print(f"{name}: {len(result['mismatches'])} mismatches, first: {result['mismatches'][0]}", file=sys.stderr)
+    elapsed = time.perf_counter() - started
+
+    if args.profile_out:
+        nordeus.profiler.export(args.profile_out)
+    print(f"Replayed {totals['sessions']} sessions ({totals['frames']} frames, {totals['games']} games, {totals['guesses']} guesses) "
+          f"in {elapsed:.2f}s, {totals['sessions'] / elapsed:.1f} sessions per second, {failed} failed.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
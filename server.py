@@ -0,0 +1,354 @@
+#
+# Asyncio game server: many players share one process, each session only keeps a map id, attempts and result.
+#
+# Usage: python server.py [--port 8080] [--pool 64] [--max-sessions 100000]
+#        python server.py --load 5000 [--connections 200] [--url http://127.0.0.1:8080]
+#
+# API (JSON over HTTP/1.1 with keep-alive):
+#   POST /games                    {"difficulty": "easy"|"hard"} -> new session
+#   GET  /games/<session>          state of a session
+#   POST /games/<session>/guess    {"x": row, "y": column}
+#   GET  /maps/<map id>            heights in the Nordeus map text format
+#
+# --load starts a server in the same process (unless --url is given) and plays that many sessions against it.
+#
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import secrets
+import statistics
+import sys
+import time
+import urllib.parse
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+
+from nordeus import GRID_SIZE, generate_batch, label_islands, island_stats
+
+ATTEMPTS = 3  # Same as Game
+DIFFICULTIES = ("easy", "hard")
+POOL_SIZE = 64  # Maps per difficulty
+MAX_SESSIONS = 100000  # Least recently used sessions are dropped beyond this
+SESSION_TTL = 600  # Seconds a session is kept without requests
+MAX_BODY = 4096  # Bytes, bigger request bodies are refused
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large"}
+
+
+#Class which will be used to hold one solved map that all sessions on it share
+#The arrays are read-only, so a map can never change under a running game
+class PooledMap:
+    __slots__ = ("id", "difficulty", "labels", "target", "average", "text")
+
+    def __init__(self, map_id, difficulty, heights):
+        labels, count = label_islands(heights)
+        sums, sizes, averages = island_stats(heights, labels, count)
+        labels.setflags(write=False)
+        self.id = map_id
+        self.difficulty = difficulty
+        self.labels = labels
+        self.target = int(np.argmax(averages[1:])) + 1 if count else 0  # Same island Game picks
+        self.average = float(averages[self.target]) if count else None
+        self.text = ("\n".join(" ".join(map(str, row)) for row in heights.tolist()) + "\n").encode("ascii")
+
+
+#Class which will be used to create the shared maps once at startup
+class MapPool:
+    def __init__(self, size=POOL_SIZE, map_size=GRID_SIZE, seed=None):
+        self.maps = []
+        self.by_difficulty = {}
+        for offset, difficulty in enumerate(DIFFICULTIES):
+            first = len(self.maps)
+            for heights in generate_batch(size, map_size, difficulty, None if seed is None else seed + offset):
+                self.maps.append(PooledMap(len(self.maps), difficulty, heights))
+            self.by_difficulty[difficulty] = range(first, len(self.maps))
+        self.rng = random.Random(seed)
+
+    def draw(self, difficulty):
+        return self.maps[self.rng.choice(self.by_difficulty[difficulty])]
+
+
+#Class which will be used as the state of one player, a few small fields instead of a GridMap
+class Session:
+    __slots__ = ("map_id", "attempts", "result", "seen")
+
+    def __init__(self, map_id):
+        self.map_id = map_id
+        self.attempts = ATTEMPTS
+        self.result = None  # None while playing, then 'won' or 'lost'
+        self.seen = time.monotonic()
+
+
+#Class which will be used to serve the game API, all sessions live in one LRU dict
+class GameServer:
+    def __init__(self, pool, max_sessions=MAX_SESSIONS, ttl=SESSION_TTL):
+        self.pool = pool
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sessions = collections.OrderedDict()  # id: Session, least recently used first
+        self.requests = 0
+        self.server = None
+
+    async def start(self, host="127.0.0.1", port=8080):
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self
+
+    @property
+    def url(self):
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def get_session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        if time.monotonic() - session.seen > self.ttl:
+            del self.sessions[session_id]
+            return None
+        session.seen = time.monotonic()
+        self.sessions.move_to_end(session_id)
+        return session
+
+    def new_session(self, difficulty):
+        pooled = self.pool.draw(difficulty)
+        session_id = secrets.token_urlsafe(9)
+        self.sessions[session_id] = Session(pooled.id)
+        # Expired sessions are at the front, memory stays bounded by max_sessions either way
+        now = time.monotonic()
+        while self.sessions and (len(self.sessions) > self.max_sessions or now - next(iter(self.sessions.values())).seen > self.ttl):
+            self.sessions.popitem(last=False)
+        return session_id
+
+    def state(self, session_id, session):
+        pooled = self.pool.maps[session.map_id]
+        return {"session": session_id, "map": pooled.id, "difficulty": pooled.difficulty, "size": list(pooled.labels.shape),
+                "attempts": session.attempts, "result": session.result}
+
+    def guess(self, session, x, y):
+        # Same rules as Game.guess_island
+        pooled = self.pool.maps[session.map_id]
+        if session.result is not None:
+            return False
+        correct = bool(pooled.target and pooled.labels[x, y] == pooled.target)
+        if correct:
+            session.result = 'won'
+        else:
+            session.attempts -= 1
+            if session.attempts == 0:
+                session.result = 'lost'
+        return correct
+
+    def route(self, method, path, body):
+        # Returns (status, JSON object or bytes)
+        parts = [part for part in urllib.parse.urlsplit(path).path.split("/") if part]
+        if parts == ["games"]:
+            if method != "POST":
+                return 405, {"error": "use POST"}
+            difficulty = body.get("difficulty", "easy")
+            if difficulty not in DIFFICULTIES:
+                return 400, {"error": f"difficulty must be one of {', '.join(DIFFICULTIES)}"}
+            session_id = self.new_session(difficulty)
+            return 201, self.state(session_id, self.sessions[session_id])
+
+        if len(parts) == 2 and parts[0] == "maps" and method == "GET":
+            if not parts[1].isdigit() or int(parts[1]) >= len(self.pool.maps):
+                return 404, {"error": "unknown map"}
+            return 200, self.pool.maps[int(parts[1])].text
+
+        if len(parts) in (2, 3) and parts[0] == "games":
+            session = self.get_session(parts[1])
+            if session is None:
+                return 404, {"error": "unknown or expired session"}
+            if len(parts) == 2:
+                return (200, self.state(parts[1], session)) if method == "GET" else (405, {"error": "use GET"})
+            if parts[2] != "guess":
+                return 404, {"error": "not found"}
+            if method != "POST":
+                return 405, {"error": "use POST"}
+            rows, columns = self.pool.maps[session.map_id].labels.shape
+            x, y = body.get("x"), body.get("y")
+            if not (isinstance(x, int) and isinstance(y, int) and 0 <= x < rows and 0 <= y < columns):
+                return 400, {"error": f"x and y must be cells of the {rows}x{columns} map"}
+            if session.result is not None:
+                return 400, {"error": f"the game is over, it was {session.result}"}
+            correct = self.guess(session, x, y)
+            return 200, dict(self.state(parts[1], session), correct=correct)
+
+        return 404, {"error": "not found"}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, version = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY:
+                    status, payload = 413, {"error": "request body too large"}
+                    keep_alive = False
+                else:
+                    raw = await reader.readexactly(length) if length else b""
+                    keep_alive = headers.get("connection", "").lower() != "close" and version.strip() == "HTTP/1.1"
+                    try:
+                        body = json.loads(raw) if raw else {}
+                        if not isinstance(body, dict):
+                            raise ValueError("the body must be a JSON object")
+                    except ValueError as e:
+                        status, payload = 400, {"error": f"bad JSON: {e}"}
+                    else:
+                        status, payload = self.route(method, path, body)
+                self.requests += 1
+
+                if isinstance(payload, bytes):
+                    content, content_type = payload, "text/plain"
+                else:
+                    content, content_type = json.dumps(payload).encode(), "application/json"
+                writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: {content_type}\r\nContent-Length: {len(content)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + content)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass  # Malformed request or the client went away, drop the connection
+        finally:
+            writer.close()
+
+
+#Class which will be used by the load generator, one keep-alive connection that sends JSON requests
+class Client:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        content = json.dumps(body).encode() if body is not None else b""
+        self.writer.write(f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
+                          f"Content-Length: {len(content)}\r\n\r\n".encode("latin-1") + content)
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        payload = await self.reader.readexactly(int(headers["content-length"]))
+        if headers.get("connection") == "close":
+            self.close()
+        return status, json.loads(payload) if headers.get("content-type") == "application/json" else payload
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+#Function which will be used to play sessions over a number of connections and time every request
+async def run_load(url, sessions, connections, seed=0):
+    parts = urllib.parse.urlsplit(url)
+    rng = random.Random(seed)
+    latencies = []
+    outcomes = collections.Counter()
+    remaining = iter(range(sessions))
+
+    async def timed(client, method, path, body=None):
+        started = time.perf_counter()
+        status, payload = await client.request(method, path, body)
+        latencies.append(time.perf_counter() - started)
+        if status >= 400:
+            raise RuntimeError(f"{method} {path} answered {status}: {payload}")
+        return payload
+
+    async def player():
+        client = Client(parts.hostname, parts.port)
+        try:
+            for _ in remaining:
+                state = await timed(client, "POST", "/games", {"difficulty": rng.choice(DIFFICULTIES)})
+                rows, columns = state["size"]
+                path = f"/games/{state['session']}"
+                while state["result"] is None:
+                    state = await timed(client, "POST", path + "/guess", {"x": rng.randrange(rows), "y": rng.randrange(columns)})
+                await timed(client, "GET", path)
+                outcomes[state["result"]] += 1
+        finally:
+            client.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(player() for _ in range(connections)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "sessions": sessions,
+        "requests": len(latencies),
+        "seconds": elapsed,
+        "requests_per_second": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+        "won": outcomes["won"],
+        "lost": outcomes["lost"],
+    }
+
+
+async def serve(args):
+    pool = MapPool(args.pool, seed=args.seed)
+    server = await GameServer(pool, args.max_sessions).start(args.host, 0 if args.load else args.port)
+    print(f"Serving {len(pool.maps)} maps on {server.url}")
+    if not args.load:
+        await server.server.serve_forever()
+        return 0
+
+    result = await run_load(args.url or server.url, args.load, args.connections, args.seed or 0)
+    print(f"{result['sessions']} sessions ({result['won']} won, {result['lost']} lost), {result['requests']} requests in {result['seconds']:.2f}s: "
+          f"{result['requests_per_second']:.0f} requests per second, p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms, "
+          f"{len(server.sessions)} sessions held")
+    await server.stop()
+    return 0
+
+
+async def load_only(args):
+    result = await run_load(args.url, args.load, args.connections, args.seed or 0)
+    print(json.dumps(result, indent=1))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the island guessing game to many players over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080, help="0 picks a free port")
+    parser.add_argument("--pool", type=int, default=POOL_SIZE, help="maps per difficulty")
+    parser.add_argument("--max-sessions", type=int, default=MAX_SESSIONS)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--load", type=int, metavar="SESSIONS", help="play this many sessions against the server and report the throughput")
+    parser.add_argument("--connections", type=int, default=200, help="concurrent players of --load")
+    parser.add_argument("--url", help="with --load, the server to test instead of one started in this process")
+    args = parser.parse_args(argv)
+
+    try:
+        return asyncio.run(load_only(args) if args.load and args.url else serve(args))
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
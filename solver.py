@@ -0,0 +1,141 @@
+#
+# Headless batch solver for map files in the same format as the Nordeus endpoint.
+#
+# Usage: python solver.py [-j WORKERS] [--json] PATH [PATH ...]
+# PATH can be a map file (plain or gzip), a map archive (see map_archive.py), a directory of them or - to read paths from stdin.
+# Maps of an archive are named ARCHIVE#POSITION and are checked against the answers stored in the archive.
+#
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from map_archive import MapArchive, is_archive
+from nordeus import read_matrix, solve_map
+
+COLUMNS = ["path", "islands", "x", "y", "size", "average", "margin", "error"]
+ANSWER_COLUMNS = ["islands", "x", "y", "size", "average", "margin"]
+
+archives = {}  # Archives opened by this worker process, by path
+
+
+#Function which will be used to list the map files behind the command line paths, lazily so huge corpora are not held in memory
+def iter_map_paths(paths):
+    for path in paths:
+        if path == "-":
+            for line in sys.stdin:
+                if line.strip():
+                    yield from iter_archive(line.strip())
+        elif os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    yield from iter_archive(os.path.join(root, name))
+        else:
+            yield from iter_archive(path)
+
+
+#Function which will be used to expand an archive into one name per map, other paths are passed through
+def iter_archive(path):
+    if not is_archive(path):
+        yield path
+        return
+    try:
+        with MapArchive(path) as archive:
+            count = len(archive)
+    except (OSError, ValueError):
+        yield path  # solve_file opens it again and reports the error for this path
+        return
+    for position in range(count):
+        yield f"{path}#{position}"
+
+
+#Function which will be used to read one map, streamed from a text or gzip file or zero-copy from an archive
+#Returns the heights and the stored answer, None for text files
+def read_map(path):
+    archive_path, _, position = path.rpartition("#")
+    if archive_path and position.isdigit() and is_archive(archive_path):
+        if archive_path not in archives:
+            archives[archive_path] = MapArchive(archive_path)
+        archive = archives[archive_path]
+        return archive.heights(int(position)), archive.info(int(position))
+    if is_archive(path):
+        # Only archives that could not be opened are passed whole, this raises the same error again
+        with MapArchive(path):
+            pass
+        raise ValueError(f"{path}: the archive could not be read")
+    return read_matrix(path), None
+
+
+#Function which will be used by the worker processes, it reads and solves one map file
+def solve_file(path):
+    try:
+        heights, stored = read_map(path)
+        result = solve_map(heights)
+        result.pop("label")
+        result["error"] = None
+        if stored is not None and any(stored[column] != result[column] for column in ANSWER_COLUMNS):
+            result["error"] = "answer differs from the one stored in the archive"
+    except (OSError, ValueError) as e:
+        result = {column: None for column in COLUMNS}
+        result["error"] = str(e)
+    result["path"] = path
+    return result
+
+
+def format_row(result, as_json):
+    if as_json:
+        return json.dumps({column: result[column] for column in COLUMNS})
+    values = []
+    for column in COLUMNS:
+        value = result[column]
+        if value is None:
+            values.append("")
+        elif isinstance(value, float):
+            values.append(f"{value:.6f}")
+        else:
+            values.append(str(value))
+    return "\t".join(values)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find the island with the greatest average height for many map files.")
+    parser.add_argument("paths", nargs="+", help="map files, directories of map files, or - to read paths from stdin")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1, help="number of worker processes (default: all cores)")
+    parser.add_argument("--chunksize", type=int, default=64, help="maps handed to a worker at a time")
+    parser.add_argument("--json", action="store_true", help="write one JSON object per map instead of tab separated values")
+    args = parser.parse_args(argv)
+
+    paths = iter_map_paths(args.paths)
+    # Only a few chunks per worker are in flight at once, so memory stays bounded for any corpus size
+    window = max(1, args.workers) * args.chunksize * 4
+    solved = errors = 0
+    started = time.perf_counter()
+
+    if not args.json:
+        print("\t".join(COLUMNS))
+
+    with multiprocessing.Pool(max(1, args.workers)) as pool:
+        while True:
+            batch = list(itertools.islice(paths, window))
+            if not batch:
+                break
+            for result in pool.imap(solve_file, batch, chunksize=args.chunksize):
+                solved += 1
+                errors += result["error"] is not None
+                print(format_row(result, args.json))
+
+    elapsed = time.perf_counter() - started
+    rate = solved / elapsed * 60 if elapsed else 0
+    print(f"Solved {solved} maps ({errors} errors) in {elapsed:.2f}s, {rate:.0f} maps per minute.", file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+#
+# Local stand-in for the Nordeus map endpoint, so the game can be tested without the network.
+#
+# Usage: python stub_server.py [--port 8000] [--delay SECONDS] [--fail-rate RATE] [--hang]
+# Then start the game with NORDEUS_MAP_URL=http://127.0.0.1:8000/jf24-fullstack-challenge/test
+#
+# python stub_server.py --check runs the game headless against a slow stub and fails
+# if any frame waited on the network.
+#
+
+import argparse
+import http.server
+import os
+import random
+import sys
+import threading
+import time
+
+MAP_PATH = "/jf24-fullstack-challenge/test"
+MAP_SIZE = 30
+FRAME_BUDGET = 0.1  # Seconds, a frame that waited on the stub would take at least the stub delay
+
+
+#Function which will be used to create a map that looks like the Nordeus ones (large islands, heights up to 1000)
+def random_map_text(rng, size=MAP_SIZE):
+    rows = []
+    for x in range(size):
+        rows.append(" ".join(str(rng.randint(1, 1000) if rng.random() < 0.45 else 0) for y in range(size)))
+    return "\n".join(rows) + "\n"
+
+
+#Class which will be used to serve random maps on a local port from a background thread
+class StubMapServer:
+    def __init__(self, port=0, delay=0.0, fail_rate=0.0, hang=False, seed=None):
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.hang = hang
+        self.rng = random.Random(seed)
+        self.requests_served = 0
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="StubMapServer", daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}{MAP_PATH}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()  # Releases hanging requests
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != MAP_PATH:
+                    self.send_error(404)
+                    return
+                if stub.hang:
+                    stub.stop_event.wait()
+                    return
+                if stub.delay:
+                    time.sleep(stub.delay)
+
+                with stub.lock:
+                    failed = stub.rng.random() < stub.fail_rate
+                    body = random_map_text(stub.rng).encode("ascii")
+                    stub.requests_served += 1
+                if failed:
+                    self.send_error(503)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+#Function which will be used to run the game headless against a slow stub and time every frame
+def check_game(delay):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+    import nordeus
+
+    stub = StubMapServer(delay=delay).start()
+    app = nordeus.GameApp()
+    app.map_url = stub.url
+    slowest = 0.0
+    games = []
+
+    def frame():
+        nonlocal slowest
+        started = time.perf_counter()
+        app.handle_events()
+        app.update()
+        app.render()
+        slowest = max(slowest, time.perf_counter() - started)
+        app.clock.tick(30)
+
+    try:
+        app.start_game('nordeus')
+        deadline = time.monotonic() + delay * 4 + 10
+        # First map, then two restarts that have to wait for the stub again
+        while len(games) < 3 and time.monotonic() < deadline:
+            frame()
+            if app.game is not None and app.game not in games:
+                games.append(app.game)
+                app.game.game_over_time = nordeus.game_clock.ticks() - nordeus.RESTART_DELAY - 1
+    finally:
+        if app.map_prefetcher:
+            app.map_prefetcher.stop()
+        stub.stop()
+
+    print(f"Nordeus games started: {len(games)}, stub requests: {stub.requests_served}, slowest frame: {slowest * 1000:.1f} ms")
+    return 0 if len(games) == 3 and slowest < FRAME_BUDGET else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve random maps like the Nordeus endpoint.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to wait before answering")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--hang", action="store_true", help="never answer, to test timeouts")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--check", action="store_true", help="run the game headless against a slow stub and check that no frame blocks")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        return check_game(args.delay or 1.0)
+
+    stub = StubMapServer(args.port, args.delay, args.fail_rate, args.hang, args.seed).start()
+    print(f"Serving maps on {stub.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
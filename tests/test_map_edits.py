@@ -0,0 +1,112 @@
+# Checks of GridMap.set_height against a full relabel after every edit, run with: python -m pytest tests
+import numpy as np
+import pytest
+
+import nordeus
+
+
+#Function which will be used to compare the islands kept up to date by the edits with a fresh labeling of the heights
+def check_islands(grid_map):
+    labels, count = nordeus.label_islands(grid_map.heights)
+    assert grid_map.island_count == count
+    land = labels > 0
+    assert np.array_equal(grid_map.labels > 0, land)
+    # Labels may differ after edits, but every fresh island must be exactly one kept island
+    pairs = set(zip(labels[land].tolist(), grid_map.labels[land].tolist()))
+    assert len(pairs) == count and {kept for _, kept in pairs} == set(range(1, count + 1))
+
+    sums, sizes, averages = nordeus.island_stats(grid_map.heights, grid_map.labels, count)
+    assert np.array_equal(grid_map.island_sums[1:count + 1], sums[1:])
+    assert np.array_equal(grid_map.island_sizes[1:count + 1], sizes[1:])
+    assert np.allclose(grid_map.island_averages[1:count + 1], averages[1:])
+    if count:
+        assert grid_map.highest_island().average_height() == averages[1:].max()
+    else:
+        assert grid_map.highest_island() is None
+
+    if grid_map._bounds is not None:
+        # Bounds may be loose, but never miss a cell of their island
+        xs, ys = np.nonzero(land)
+        kept = grid_map.labels[xs, ys]
+        x0, x1, y0, y1 = grid_map._bounds[:, kept]
+        assert ((x0 <= xs) & (xs <= x1) & (y0 <= ys) & (ys <= y1)).all()
+
+
+#Function which will be used to make random edits, most of them turn land into water so islands split
+def random_edits(grid_map, rng, count, land_share=0.4):
+    rows, cols = grid_map.heights.shape
+    for _ in range(count):
+        x, y = int(rng.integers(rows)), int(rng.integers(cols))
+        height = int(rng.integers(1, nordeus.MAX_HEIGHT + 1)) if rng.random() < land_share else 0
+        grid_map.set_height(x, y, height)
+        yield x, y, height
+
+
+@pytest.mark.parametrize("seed", range(12))
+def test_random_edits(seed):
+    rng = np.random.default_rng(seed)
+    rows, cols = int(rng.integers(3, 40)), int(rng.integers(3, 40))
+    heights = rng.integers(1, nordeus.MAX_HEIGHT + 1, (rows, cols)) * (rng.random((rows, cols)) < rng.uniform(0.3, 0.8))
+    grid_map = nordeus.GridMap(predefined_matrix=heights)
+    for _ in random_edits(grid_map, rng, 300):
+        check_islands(grid_map)
+
+
+def test_splits_of_big_islands(monkeypatch):
+    # Dense maps cut rings without splitting, tiny search budgets make some splits relabel the bounding box instead
+    for budget in (nordeus.SPLIT_SEARCH_CELLS, 8):
+        monkeypatch.setattr(nordeus, "SPLIT_SEARCH_CELLS", budget)
+        rng = np.random.default_rng(budget)
+        heights = rng.integers(1, nordeus.MAX_HEIGHT + 1, (60, 60)) * (rng.random((60, 60)) < 0.65)
+        grid_map = nordeus.GridMap(predefined_matrix=heights)
+        for _ in random_edits(grid_map, rng, 400, land_share=0.1):
+            check_islands(grid_map)
+
+
+def test_split_ring():
+    # Removing the middle of a plus sign leaves four islands, a ring around a hole stays one island
+    heights = np.zeros((7, 7), dtype=np.uint16)
+    heights[3, 1:6] = heights[1:6, 3] = 5
+    heights[3, 3] = 9
+    grid_map = nordeus.GridMap(predefined_matrix=heights)
+    grid_map.set_height(3, 3, 0)
+    assert grid_map.island_count == 4
+    check_islands(grid_map)
+
+    heights = np.full((5, 5), 3, dtype=np.uint16)
+    heights[2, 2] = 0
+    grid_map = nordeus.GridMap(predefined_matrix=heights)
+    grid_map.set_height(1, 2, 0)
+    assert grid_map.island_count == 1
+    check_islands(grid_map)
+
+
+def test_cell_height_setter():
+    grid_map = nordeus.GridMap(predefined_matrix=np.array([[1, 0, 0], [0, 0, 0], [0, 0, 9]]))
+    grid_map.grid[2][2].height = 0
+    assert grid_map.island_at(2, 2) is None
+    assert grid_map.highest_island().average_height() == 1
+    check_islands(grid_map)
+    with pytest.raises(ValueError):
+        grid_map.grid[0][0].height = nordeus.MAX_HEIGHT + 1
+
+
+def test_edit_after_win():
+    # Clearing the other island moves the target's label, the found island must stay the target
+    heights = np.zeros((5, 5), dtype=np.uint16)
+    heights[0, 0] = 2
+    heights[3:5, 3:5] = 9
+    game = nordeus.Game(predefined_matrix=heights)
+    game.guess_island(game.map.grid[4][4])
+    assert game.correct_guess and game.map.island_at(4, 4).label == 2
+
+    game.edit_cell(0, 0, 0)
+    assert game.map.island_count == 1
+    assert game.target_island is game.map.islands[0] and game.target_island.label == 1
+    assert game.target_island.average_height() == 9
+
+    game.edit_cell(4, 4, 0)  # The target itself shrinks but stays
+    assert game.target_island is game.map.island_at(3, 3)
+    for x, y in ((3, 3), (3, 4), (4, 3)):
+        game.edit_cell(x, y, 0)
+    assert game.target_island is None
@@ -0,0 +1,112 @@
+# Checks of read_matrix and MapParser, run with: python -m pytest tests
+import gzip
+
+import numpy as np
+import pytest
+
+import nordeus
+
+
+#Function which will be used to write a height array in the endpoint's text format
+def map_text(heights, newline=b"\n"):
+    return newline.join(b" ".join(b"%d" % value for value in row) for row in heights.tolist()) + newline
+
+
+#Function which will be used to feed text in small pieces, with blocks of a few lines parsed at a time
+def read_in_pieces(data, piece=7, **kwargs):
+    return nordeus.read_matrix([data[start:start + piece] for start in range(0, len(data), piece)], **kwargs)
+
+
+@pytest.fixture
+def small_blocks(monkeypatch):
+    monkeypatch.setattr(nordeus, "PARSE_CHUNK_BYTES", 32)
+
+
+def random_heights(rows=23, cols=17, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, nordeus.MAX_HEIGHT + 1, (rows, cols)) * (rng.random((rows, cols)) < 0.6)
+
+
+def test_round_trip_in_blocks(small_blocks):
+    heights = random_heights()
+    for data in (map_text(heights), map_text(heights)[:-1], map_text(heights, b"\r\n"), b"\n\n" + map_text(heights) + b"\n\n"):
+        parsed = read_in_pieces(data)
+        assert parsed.dtype == nordeus.HEIGHT_DTYPE
+        assert np.array_equal(parsed, heights)
+
+
+def test_separators_and_leading_zeros():
+    assert nordeus.parse_matrix("  1\t 0002 \r\n0 1000  \n").tolist() == [[1, 2], [0, 1000]]
+
+
+@pytest.mark.parametrize("data, message", [
+    (b"1 2\n3 x\n", "Row 1, column 1: unexpected character 'x'."),
+    (b"1 2\n3 -4\n", "Row 1, column 1: unexpected character '-'."),
+    (b"1 2\n3 1001\n", "Row 1, column 1: height 1001 is outside 0..1000."),
+    (b"1 2\n00000000012345 0\n", "Row 1, column 0: height 00000000012345 is outside 0..1000."),
+    (b"1 2\n3\n", "Row 1 has 1 values, expected 2."),
+    (b"1 2\n\n3 4\n", "Row 1 has 0 values, expected 2."),
+    (b"\n \n", "The matrix is empty."),
+    (b"", "The matrix is empty."),
+])
+def test_errors(data, message):
+    with pytest.raises(ValueError) as error:
+        nordeus.read_matrix(data)
+    assert str(error.value) == message
+
+
+@pytest.mark.parametrize("row", [0, 5, 9, 19])
+def test_error_position_across_blocks(small_blocks, row):
+    heights = random_heights(20, 6)
+    lines = map_text(heights).split(b"\n")
+    for column, (bad, message) in enumerate([(b"12a", "unexpected character 'a'"), (b"2000", "height 2000 is outside 0..1000")]):
+        values = lines[row].split(b" ")
+        values[column + 2] = bad
+        broken = b"\n".join(lines[:row] + [b" ".join(values)] + lines[row + 1:])
+        with pytest.raises(ValueError) as error:
+            read_in_pieces(broken, piece=5)
+        assert str(error.value) == f"Row {row}, column {column + 2}: {message}."
+
+
+def test_blank_line_across_blocks(small_blocks):
+    lines = map_text(random_heights(12, 4)).split(b"\n")
+    with pytest.raises(ValueError) as error:
+        read_in_pieces(b"\n".join(lines[:8] + [b""] + lines[8:]), piece=3)
+    assert str(error.value) == "Row 8 has 0 values, expected 4."
+
+
+def test_gzip(small_blocks):
+    heights = random_heights()
+    data = gzip.compress(map_text(heights[:10])) + gzip.compress(map_text(heights[10:]))  # Two members, like concatenated files
+    assert np.array_equal(read_in_pieces(data, piece=1), heights)
+    assert np.array_equal(nordeus.read_matrix(data), heights)
+
+
+def test_truncated_gzip():
+    data = gzip.compress(map_text(random_heights()))
+    for end in (2, 20, len(data) - 4):
+        with pytest.raises(ValueError, match="The gzip stream is truncated."):
+            nordeus.read_matrix(data[:end])
+
+
+def test_corrupt_gzip():
+    data = gzip.compress(map_text(random_heights()))
+    with pytest.raises(ValueError, match="The gzip stream is corrupt"):
+        nordeus.read_matrix(data[:10] + b"\xff" * 20 + data[30:])
+
+
+def test_max_cells(small_blocks):
+    data = map_text(random_heights(20, 5))
+    assert read_in_pieces(data, max_cells=100).shape == (20, 5)
+    with pytest.raises(ValueError, match="more than 99 cells"):
+        read_in_pieces(data, max_cells=99)
+
+
+def test_sources(tmp_path):
+    heights = random_heights()
+    path = tmp_path / "map.txt.gz"
+    path.write_bytes(gzip.compress(map_text(heights)))
+    assert np.array_equal(nordeus.read_matrix(path), heights)
+    assert np.array_equal(nordeus.read_matrix(str(path)), heights)
+    with open(path, "rb") as map_file:
+        assert np.array_equal(nordeus.read_matrix(map_file, chunk_size=11), heights)